@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+"""Benchmark of Console's Slippstream event parsing on item-heavy frames
+
+Builds synthetic Slippstream messages, each holding one whole frame of events
+(4 players plus a varying number of items), and times how long the Console
+takes to parse them. Parsing should scale linearly with the number of events.
+
+Compares the old loop, which sliced the handled event off the front of the
+message after every event (copying the rest of it each time), against the
+Console's own parser, which walks an offset through the message instead.
+"""
+import argparse
+import struct
+import time
+
+import melee
+from melee import slp
+from melee.slippstream import EventType
+
+# Event sizes, including the command byte
+SIZES = {0x36: 0x1A1, 0x37: 0x41, 0x38: 0x69, 0x39: 0x3, 0x3a: 0x9, 0x3b: 0x2C, 0x3c: 0x9}
+
+def event(command, *fields):
+    """Build one event, given (offset, struct format, value) fields"""
+    buf = bytearray(SIZES[command])
+    buf[0] = command
+    for offset, fmt, value in fields:
+        struct.pack_into(">" + fmt, buf, offset, value)
+    return bytes(buf)
+
+def setup_message():
+    """The PAYLOADS and GAME_START events that begin every game"""
+    payloads = bytearray([0x35, 1 + 3 * len(SIZES)])
+    for command, size in SIZES.items():
+        payloads += struct.pack(">BH", command, size - 1)
+    return bytes(payloads) + event(0x36, (0x1, "B", 3), (0x2, "B", 7), (0x13, "H", 0x20))
+
+def frame_message(frame, items):
+    """One frame's worth of events, the way Slippstream batches them"""
+    message = event(0x3a, (0x1, "i", frame))
+    for port in range(4):
+        message += event(0x37, (0x1, "i", frame), (0x5, "B", port))
+    for port in range(4):
+        message += event(0x38, (0x1, "i", frame), (0x5, "B", port), (0x7, "B", 0x1), (0x8, "H", 0x0e),
+                         (0xa, "f", 10.), (0xe, "f", 5.), (0x12, "f", 1.))
+    for _ in range(items):
+        message += event(0x3b, (0x1, "i", frame), (0x5, "H", 0x36), (0x14, "f", 1.), (0x2a, "B", 0))
+    message += event(0x3c, (0x1, "i", frame))
+    return message
+
+def slice_parser(console):
+    """The old event loop: handle the first event, then slice it off the front of the message
+
+    Uses the Console's own event handlers, so only the loop itself differs.
+    """
+    def handle(event_bytes, gamestate):
+        gamestate.menu_state = melee.Menu.IN_GAME
+        while len(event_bytes) > 0:
+            event_size = console.eventsize[event_bytes[0]]
+            if len(event_bytes) < event_size:
+                return False
+            if EventType(event_bytes[0]) == EventType.PAYLOADS:
+                payload_size = slp.read_payload_sizes(event_bytes, 0, console.eventsize)
+                console._Console__compile_layouts()
+                event_bytes = event_bytes[payload_size:]
+
+            elif EventType(event_bytes[0]) == EventType.FRAME_START:
+                event_bytes = event_bytes[event_size:]
+
+            elif EventType(event_bytes[0]) == EventType.GAME_START:
+                console._Console__game_start(gamestate, event_bytes, 0)
+                event_bytes = event_bytes[event_size:]
+
+            elif EventType(event_bytes[0]) == EventType.GAME_END:
+                event_bytes = event_bytes[event_size:]
+                return console._use_manual_bookends
+
+            elif EventType(event_bytes[0]) == EventType.PRE_FRAME:
+                console._Console__pre_frame(gamestate, event_bytes, 0)
+                event_bytes = event_bytes[event_size:]
+
+            elif EventType(event_bytes[0]) == EventType.POST_FRAME:
+                console._Console__post_frame(gamestate, event_bytes, 0)
+                event_bytes = event_bytes[event_size:]
+
+            elif EventType(event_bytes[0]) == EventType.GECKO_CODES:
+                event_bytes = event_bytes[event_size:]
+
+            elif EventType(event_bytes[0]) == EventType.FRAME_BOOKEND:
+                console._Console__frame_bookend(gamestate, event_bytes, 0)
+                event_bytes = event_bytes[event_size:]
+                if gamestate.frame <= console._frame:
+                    return False
+                console._frame = gamestate.frame
+                return True
+
+            elif EventType(event_bytes[0]) == EventType.ITEM_UPDATE:
+                console._Console__item_update(gamestate, event_bytes, 0)
+                event_bytes = event_bytes[event_size:]
+
+            else:
+                return False
+        return False
+    return handle
+
+def offset_parser(console):
+    """The Console's own event loop, which walks an offset through the message"""
+    return console._Console__handle_slippstream_events
+
+def run(make_parser, messages, repeat=3):
+    """Parse every message. Returns microseconds per frame, from the best of a few runs"""
+    best = None
+    for _ in range(repeat):
+        console = melee.Console(is_dolphin=False)
+        handle = make_parser(console)
+        handle(setup_message(), melee.GameState())
+        start = time.perf_counter()
+        for message in messages:
+            handle(message, melee.GameState())
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / len(messages) * 1e6
+
+def parse_one(make_parser, message):
+    """Parse a single frame, and return what was decoded from it"""
+    console = melee.Console(is_dolphin=False)
+    handle = make_parser(console)
+    handle(setup_message(), melee.GameState())
+    gamestate = melee.GameState()
+    handle(message, gamestate)
+    return gamestate.frame, [(port, player.action, player.x) for port, player in gamestate.player.items()], \
+        [(item.subtype, item.x) for item in gamestate.projectiles]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of Slippstream event parsing')
+    parser.add_argument('--frames', '-f', type=int, default=2000, help='Frames to parse per run')
+    args = parser.parse_args()
+
+    print("items/frame  bytes/frame  slice us  offset us  slice us/event  offset us/event")
+    for item_count in (0, 15, 60, 250, 1000):
+        messages = [frame_message(frame, item_count) for frame in range(args.frames)]
+        assert parse_one(slice_parser, messages[0]) == parse_one(offset_parser, messages[0])
+        sliced = run(slice_parser, messages)
+        offset = run(offset_parser, messages)
+        events = 10 + item_count
+        print("%11d  %11d  %8.1f  %9.1f  %14.2f  %15.2f" % (item_count, len(messages[0]), sliced, offset,
+                                                          sliced / events, offset / events))
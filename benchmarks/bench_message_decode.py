@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+"""Benchmark of turning raw Slippstream packets into event bytes
+
+Compares the plain path (json.loads() on the whole packet, then base64 decoding
+the payload string) against slippstream.parse_message(), which finds the
+payload in place and decodes it straight out of the packet.
+"""
+import argparse
+import base64
+import json
+import time
+
+from melee.slippstream import parse_message
+
+from bench_event_parsing import frame_message
+
+def packet(frame, items):
+    """One game_event packet, the way Slippi sends them"""
+    return json.dumps({
+        "type": "game_event",
+        "cursor": frame,
+        "next_cursor": frame + 1,
+        "payload": base64.b64encode(frame_message(frame, items)).decode(),
+    }, separators=(",", ":")).encode()
+
+def plain_decode(data):
+    message = json.loads(data)
+    return base64.b64decode(message["payload"])
+
+def fast_decode(data):
+    return parse_message(data)["payload"]
+
+def run(decode, packets, repeat=3):
+    """Decode every packet. Returns microseconds per packet, from the best of a few runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data in packets:
+            decode(data)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / len(packets) * 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of Slippstream message decoding')
+    parser.add_argument('--frames', '-f', type=int, default=5000, help='Packets to decode per run')
+    args = parser.parse_args()
+
+    print("items/frame  bytes/packet  plain us  fast us  saved us")
+    for item_count in (0, 15, 60, 250):
+        packets = [packet(frame, item_count) for frame in range(args.frames)]
+        assert plain_decode(packets[0]) == fast_decode(packets[0])
+        plain = run(plain_decode, packets)
+        fast = run(fast_decode, packets)
+        print("%11d  %12d  %8.2f  %7.2f  %8.2f" % (item_count, len(packets[0]), plain, fast, plain - fast))
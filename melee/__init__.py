@@ -3,12 +3,19 @@ Python3 only
 Works on Linux/OSX/Windows
 """
 from melee.console import *
+from melee.consolegroup import *
 from melee.logger import *
+from melee.latency import *
+from melee.waitstrategy import *
 from melee.gamestate import *
 from melee.enums import *
 from melee.controller import *
+from melee.macro import *
 from melee.framedata import *
 from melee.menuhelper import *
 from melee.stages import *
 from melee.version import *
-from melee import menuhelper, techskill, framedata, stages
+from melee.corpus import *
+from melee.cache import *
+from melee.sharedstate import *
+from melee import menuhelper, techskill, framedata, stages, slp, testing
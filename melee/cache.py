@@ -0,0 +1,252 @@
+"""An on-disk cache of decoded replays
+
+Decoded columns (see slp.load_columns) are stored as raw .npy files, one per array,
+so they can be memory mapped straight back in. Entries are keyed by a hash of the
+SLP file's contents, and live under a decoder-<slp.DECODER_VERSION> directory.
+So when the decoder changes, old entries are simply never looked at again. They
+still count towards the cache's size though, and since they stop getting used,
+they're the first to be evicted. (Or see purge_old_versions() to clean them up
+right away.)
+
+Every directory the cache makes gets a marker file, and the cache only ever
+deletes directories that carry one. So it's safe to point it at a directory that
+has other things in it.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from numpy.lib import recfunctions
+
+from melee import slp
+
+# Marks the directories the cache made, and so is allowed to delete
+_MARKER = ".libmelee-replay-cache"
+_VERSION_PREFIX = "decoder-"
+
+class ReplayCache:
+    """Size-bounded LRU cache of decoded replays
+
+    Example:
+        cache = melee.ReplayCache("/data/slp_cache", max_bytes=50 * 2**30)
+        columns = cache.load_columns("game.slp")
+
+    Note:
+        Several processes can share a cache directory. Each one keeps its own estimate of the
+        cache's size, and rescans the directory before evicting. So the size bound is enforced
+        approximately when there are many writers.
+    """
+    def __init__(self, directory, max_bytes=10 * 2**30, purge_old_versions=False):
+        """Open (or create) a cache
+
+        Args:
+            directory (str): Where to keep the cache
+            max_bytes (int): Evict least recently used entries once the cache grows past this
+            purge_old_versions (bool): Remove the entries of other decoder versions right away.
+                (See purge_old_versions())
+        """
+        self.directory = directory
+        """(str): Root directory of the cache"""
+        self.max_bytes = max_bytes
+        """(int): Size limit of the cache, in bytes"""
+        self._root = os.path.join(directory, _VERSION_PREFIX + slp.DECODER_VERSION)
+        self._make_root()
+        self._size = None
+        if purge_old_versions:
+            self.purge_old_versions()
+
+    def __getstate__(self):
+        # Don't send our size estimate along to worker processes
+        state = self.__dict__.copy()
+        state["_size"] = None
+        return state
+
+    @property
+    def index_directory(self):
+        """(str): Where frame indexes are kept, when this cache is passed to FrameIndex.for_file()"""
+        return os.path.join(self._root, ".index")
+
+    def _make_root(self):
+        """Create the directory for this version of the decoder, marked as the cache's own"""
+        os.makedirs(self._root, exist_ok=True)
+        marker = os.path.join(self._root, _MARKER)
+        if not os.path.exists(marker):
+            with open(marker, "w"):
+                pass
+
+    def _old_versions(self):
+        """(list of str): Directories of other versions of the decoder, that the cache made itself"""
+        versions = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.name.startswith(_VERSION_PREFIX) and entry.path != self._root \
+                    and os.path.isfile(os.path.join(entry.path, _MARKER)):
+                versions.append(entry.path)
+        return versions
+
+    def purge_old_versions(self):
+        """Remove entries written by other versions of the decoder
+
+        Only directories the cache made itself (with its marker file in them) are removed.
+        Anything else in the cache directory is left alone.
+        """
+        for path in self._old_versions():
+            shutil.rmtree(path, ignore_errors=True)
+        self._size = None
+
+    @staticmethod
+    def key(path):
+        """The cache key of an SLP file: a hash of its contents
+
+        Args:
+            path (str): Path to the SLP file
+
+        Returns:
+            str
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, mode='rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self, path, key=None):
+        """Look up the decoded columns of an SLP file
+
+        Args:
+            path (str): Path to the SLP file
+            key (str): Its cache key, if already known
+
+        Returns:
+            dict: Same layout as slp.load_columns(), with arrays memory mapped read-only.
+                None if the file isn't in the cache.
+        """
+        entry = os.path.join(self._root, key or self.key(path))
+        try:
+            names = os.listdir(entry)
+        except FileNotFoundError:
+            return None
+        columns = {"pre_frame": {}, "post_frame": {}}
+        try:
+            for name in names:
+                array = np.load(os.path.join(entry, name), mmap_mode='r')
+                parts = name[:-len(".npy")].split(".")
+                if len(parts) == 2:
+                    columns[parts[0]][int(parts[1])] = array
+                else:
+                    columns[parts[0]] = array
+        except FileNotFoundError:
+            # Another process evicted it out from under us
+            return None
+        # Mark this entry as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return columns
+
+    def put(self, path, columns, key=None):
+        """Add the decoded columns of an SLP file to the cache
+
+        Args:
+            path (str): Path to the SLP file
+            columns (dict): What slp.load_columns() returned for it
+            key (str): Its cache key, if already known
+        """
+        entry = os.path.join(self._root, key or self.key(path))
+        if os.path.isdir(entry):
+            return
+        # Write into a scratch directory and then rename it, so readers never see half an entry
+        scratch = tempfile.mkdtemp(dir=self._root, prefix=".tmp")
+        size = 0
+        try:
+            for name, value in columns.items():
+                if isinstance(value, dict):
+                    for port, array in value.items():
+                        size += self._save(os.path.join(scratch, name + "." + str(port) + ".npy"), array)
+                else:
+                    size += self._save(os.path.join(scratch, name + ".npy"), value)
+            os.rename(scratch, entry)
+        except OSError:
+            # Most likely another process cached the same file at the same time
+            shutil.rmtree(scratch, ignore_errors=True)
+            return
+        if self._size is not None:
+            self._size += size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    @staticmethod
+    def _save(path, array):
+        # Drop the padding between fields that the raw event layout has
+        np.save(path, np.ascontiguousarray(recfunctions.repack_fields(array)))
+        return os.path.getsize(path)
+
+    def load_columns(self, path, rollback=slp.ROLLBACK_LAST):
+        """Decoded columns of an SLP file, from the cache if possible
+
+        Drop-in replacement for slp.load_columns() that fills in the cache on a miss.
+
+        Args:
+            path (str): Path to the SLP file
+            rollback (str): Which copy of rolled back frames to keep. (See slp.load_columns())
+
+        Returns:
+            dict: See slp.load_columns()
+        """
+        key = self.key(path)
+        if rollback != slp.ROLLBACK_LAST:
+            key += "-" + rollback
+        columns = self.get(path, key)
+        if columns is None:
+            columns = slp.load_columns(path, rollback)
+            self.put(path, columns, key)
+        return columns
+
+    def _entries(self):
+        """(list of (float, int, str)): Last use time, size, and path of every entry
+
+        Includes the entries of other versions of the decoder, so that they count towards
+        max_bytes too.
+        """
+        entries = []
+        for root in [self._root] + self._old_versions():
+            for entry in os.scandir(root):
+                # Skips half written entries (.tmp*) and the frame indexes (.index)
+                if not entry.is_dir() or entry.name.startswith("."):
+                    continue
+                try:
+                    size = 0
+                    for item in os.scandir(entry.path):
+                        size += item.stat().st_size
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError:
+                    # Evicted by another process
+                    pass
+        return entries
+
+    @property
+    def size(self):
+        """(int): Approximate size of the cache, in bytes"""
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        """Remove everything from the cache"""
+        shutil.rmtree(self._root, ignore_errors=True)
+        self._make_root()
+        self._size = 0
@@ -4,9 +4,11 @@ This can be Dolphin (Slippi's Ishiiruka) or an SLP file. The Console object
 is your method to start and stop Dolphin, set configs, and get the latest GameState.
 """
 
-from collections import defaultdict
+from collections import defaultdict, deque
 from packaging import version
 
+import asyncio
+import threading
 import time
 import os
 import configparser
@@ -20,10 +22,22 @@ from pathlib import Path
 
 from melee import enums
 from melee.gamestate import GameState, Projectile, Action, PlayerState
-from melee.slippstream import SlippstreamClient, CommType, EventType
-from melee.slpfilestreamer import SLPFileStreamer
-from melee import stages
-
+from melee.latency import FrameTimings
+from melee.slippstream import SlippstreamClient, AsyncSlippstreamClient, CommType, EventType
+from melee.slpfilestreamer import SLPFileStreamer, SLPFileFollower
+from melee import slp, stages
+
+
+# Command bytes of each event type, for quick comparisons while parsing
+_GECKO_CODES = EventType.GECKO_CODES.value
+_PAYLOADS = EventType.PAYLOADS.value
+_GAME_START = EventType.GAME_START.value
+_PRE_FRAME = EventType.PRE_FRAME.value
+_POST_FRAME = EventType.POST_FRAME.value
+_GAME_END = EventType.GAME_END.value
+_FRAME_START = EventType.FRAME_START.value
+_ITEM_UPDATE = EventType.ITEM_UPDATE.value
+_FRAME_BOOKEND = EventType.FRAME_BOOKEND.value
 
 class SlippiVersionTooLow(Exception):
     """Raised when the Slippi version is not recent enough"""
@@ -43,7 +57,14 @@ class Console:
                  blocking_input=False,
                  polling_mode=False,
                  allow_old_version=False,
-                 logger=None):
+                 logger=None,
+                 follow=False,
+                 background_decode=False,
+                 frame_queue_size=8,
+                 reconnect_timeout=None,
+                 catch_up=False,
+                 wait_strategy=None,
+                 index_cache=None):
         """Create a Console object
 
         Args:
@@ -61,6 +82,28 @@ class Console:
                 Only enable if you know what you're doing. You probably don't want this.
                 Gamestates will be missing key information, come in really late, or possibly not work at all
             logger (logger.Logger): Logger instance to use. None for no logger.
+            follow (bool): Follow an SLP file that is still being written, like 'tail -f'.
+                step() waits for each new frame to land in the file. Only used when is_dolphin is False.
+            background_decode (bool): Receive and decode frames on a background thread, so that
+                network and decoding time overlap with your bot's own work. step() then just hands
+                back the newest frame that's ready, skipping any older ones. Only used when
+                is_dolphin is True, and not with aconnect()
+            frame_queue_size (int): With background_decode, how many decoded frames to hold on to
+                before the oldest ones get dropped
+            reconnect_timeout (float): If the connection to Dolphin drops, keep trying to reconnect
+                for this many seconds. The stream picks up from where it left off, so the game
+                carries on as though nothing happened. None to give up right away
+            catch_up (bool): If your bot falls behind, skip ahead to the newest frame rather than
+                working through the backlog one frame at a time. step() drains everything that's
+                already arrived, and returns only the newest complete frame. The skipped frames
+                are still decoded, so state carried across frames stays correct. Skipped frames
+                are counted in frames_dropped. Only used with Dolphin, or when following a file
+            wait_strategy (waitstrategy.WaitStrategy): In polling mode, how step() waits for the next
+                frame before giving up and returning None. (See SpinWait, SpinThenSleepWait and
+                FrameDeadlineWait) None to not wait at all
+            index_cache (str or cache.ReplayCache): Where to save the frame index that seek() builds,
+                so it doesn't have to be built again next time: a directory, or a ReplayCache.
+                None to keep it in memory only. Only used when reading an SLP file
         """
         self.logger = logger
         self.is_dolphin = is_dolphin
@@ -78,6 +121,7 @@ class Console:
         self.version = ""
         """(str): The Slippi version of the console"""
         self.cursor = 0
+        """(int): Position in the console's stream, just past the last message handled"""
         self.controllers = []
         self._current_stage = enums.Stage.NO_STAGE
         self._frame = 0
@@ -88,14 +132,34 @@ class Console:
         self._use_manual_bookends = False
         self._costumes = {0:0, 1:0, 2:0, 3:0}
         self._cpu_level = {0:0, 1:0, 2:0, 3:0}
+        # Event decoders, recompiled whenever the stream tells us its event sizes
+        self.__compile_layouts()
+
+        self.timings = FrameTimings()
+        """(latency.FrameTimings): How long each stage of step() takes, frame by frame"""
+        self._step_end = None
 
         # Keep a running copy of the last gamestate produced
         self._prev_gamestate = GameState()
         # Half-completed gamestate not yet ready to add to the list
         self._temp_gamestate = None
         self._process = None
+        # Background decoding. The receiver thread owns all the decoding state above
+        self._background_decode = background_decode and is_dolphin
+        self._receiver = None
+        self._receiver_stopping = threading.Event()
+        self._receiver_done = False
+        self._receiver_error = None
+        self._frame_queue = deque(maxlen=max(1, frame_queue_size))
+        self._frame_ready = threading.Condition()
+        self.frames_dropped = 0
+        """(int): Frames that were decoded but never returned by step(). (See background_decode and catch_up)"""
+        self._catch_up = catch_up and (is_dolphin or follow)
+        self.wait_strategy = wait_strategy
+        """(waitstrategy.WaitStrategy): How step() waits for frames in polling mode. Keeps count of the time spent"""
         if self.is_dolphin:
-            self._slippstream = SlippstreamClient(self.slippi_address, self.slippi_port)
+            self._slippstream = SlippstreamClient(self.slippi_address, self.slippi_port,
+                                                  reconnect_timeout=reconnect_timeout)
             if self.path:
                 # Setup some dolphin config options
                 dolphin_config_path = self._get_dolphin_config_path() + "Dolphin.ini"
@@ -110,8 +174,10 @@ class Console:
                 config.set("Core", 'BlockingPipes', str(blocking_input))
                 with open(dolphin_config_path, 'w') as dolphinfile:
                     config.write(dolphinfile)
+        elif follow:
+            self._slippstream = SLPFileFollower(self.path)
         else:
-            self._slippstream = SLPFileStreamer(self.path)
+            self._slippstream = SLPFileStreamer(self.path, index_cache)
 
         # Prepare some structures for fixing melee data
         path = os.path.dirname(os.path.realpath(__file__))
@@ -145,9 +211,91 @@ class Console:
         #   for the actual server to start. So try a few times before giving up.
         for _ in range(4):
             if self._slippstream.connect():
+                if self._background_decode and self._receiver is None:
+                    self._receiver = threading.Thread(target=self.__receive_frames, name="melee-decode", daemon=True)
+                    self._receiver.start()
                 return True
         return False
 
+    @property
+    def queue_depth(self):
+        """(int): With background_decode, how many decoded frames are waiting to be picked up"""
+        return len(self._frame_queue)
+
+    def __receive_frames(self):
+        """Body of the background decode thread
+
+        Reads and decodes messages as they come in, and queues up each finished gamestate.
+        """
+        try:
+            while not self._receiver_stopping.is_set() and not self._slippstream.disconnected:
+                message = self._slippstream.receive(100)
+                if message is None:
+                    continue
+                if self._temp_gamestate is None:
+                    self._temp_gamestate = GameState()
+                if self._handle_message(message):
+                    gamestate = self._finish_frame()
+                    with self._frame_ready:
+                        if len(self._frame_queue) == self._frame_queue.maxlen:
+                            self.frames_dropped += 1
+                        self._frame_queue.append(gamestate)
+                        self._frame_ready.notify()
+        except Exception as error: # pylint: disable=broad-except
+            # Let step() raise it, over on the main thread
+            self._receiver_error = error
+        with self._frame_ready:
+            self._receiver_done = True
+            self._frame_ready.notify()
+
+    def __next_decoded_frame(self):
+        """Pop the newest frame the decode thread has finished
+
+        Returns:
+            GameState: Or None if the connection is gone (or in polling mode, if nothing is ready)
+        """
+        while True:
+            with self._frame_ready:
+                while not self._frame_queue:
+                    if self._receiver_error is not None:
+                        error, self._receiver_error = self._receiver_error, None
+                        raise error
+                    if self._receiver_done or self._polling_mode:
+                        break
+                    self._frame_ready.wait()
+                if self._frame_queue:
+                    gamestate = self._frame_queue.pop()
+                    self.frames_dropped += len(self._frame_queue)
+                    self._frame_queue.clear()
+                    break
+                if self._receiver_done:
+                    return None
+            # Polling mode, and nothing's ready. Wait outside the lock, so the decode thread can get at it
+            if self.wait_strategy is None or not self.wait_strategy.wait(self.__poll_decoded):
+                return None
+        self._frametimestamp = time.time()
+        if self.wait_strategy is not None:
+            self.wait_strategy.frame_arrived()
+        return gamestate
+
+    def __poll_decoded(self, timeout):
+        """Wait up to timeout seconds for the decode thread to have something for us"""
+        with self._frame_ready:
+            if timeout > 0 and not self._frame_queue:
+                self._frame_ready.wait(timeout)
+            if self._frame_queue or self._receiver_done or self._receiver_error is not None:
+                return True
+        return None
+
+    def __poll(self, timeout):
+        """Check for a message, waiting up to timeout seconds for one"""
+        if timeout > 0:
+            if isinstance(self._slippstream, SlippstreamClient):
+                # Waits on the socket, so it comes back as soon as anything arrives
+                return self._slippstream.receive(timeout * 1000)
+            time.sleep(timeout)
+        return self._slippstream.dispatch(True)
+
     def run(self, iso_path=None, dolphin_config_path=None):
         """Run the Dolphin emulator.
 
@@ -184,6 +332,10 @@ class Console:
         For Dolphin instances, this will kill the dolphin process.
         For Wiis and SLP files, it just shuts down our connection
          """
+        if self._receiver is not None:
+            self._receiver_stopping.set()
+            self._receiver.join()
+            self._receiver = None
         if self.path:
             self.connected = False
             self._slippstream.shutdown()
@@ -260,139 +412,326 @@ class Console:
 
         Returns:
             GameState object that represents new current state of the game"""
+        start = time.perf_counter_ns()
+        timings = self.timings
+        if self._step_end is not None:
+            timings.bot.record(start - self._step_end)
+        self._step_end = None
         self.processingtime = time.time() - self._frametimestamp
 
         # Flush the controllers
         for controler in self.controllers:
             controler.flush()
+        flushed = time.perf_counter_ns()
+        timings.flush.record(flushed - start)
+
+        if self._receiver is not None:
+            gamestate = self.__next_decoded_frame()
+            if gamestate is not None:
+                self._step_end = time.perf_counter_ns()
+                timings.network.record(self._step_end - flushed)
+                timings.step.record(self._step_end - start)
+            return gamestate
 
         if self._temp_gamestate is None:
             self._temp_gamestate = GameState()
 
         frame_ended = False
+        waiting = 0
+        event_decode = 0
+        decode_time = getattr(self._slippstream, "decode_time", 0)
         while not frame_ended:
+            before = time.perf_counter_ns()
             message = self._slippstream.dispatch(self._polling_mode)
+            if not message and self._polling_mode and self.wait_strategy is not None \
+                    and not self._slippstream.disconnected:
+                message = self.wait_strategy.wait(self.__poll)
+            received = time.perf_counter_ns()
+            waiting += received - before
             if message:
-                if message["type"] == "connect_reply":
-                    self.connected = True
-                    self.nick = message["nick"]
-                    self.version = message["version"]
-                    self.cursor = message["cursor"]
-
-                elif message["type"] == "game_event":
-                    if len(message["payload"]) > 0:
-                        if self.is_dolphin:
-                            frame_ended = self.__handle_slippstream_events(base64.b64decode(message["payload"]), self._temp_gamestate)
-                        else:
-                            frame_ended = self.__handle_slippstream_events(message["payload"], self._temp_gamestate)
-
-                elif message["type"] == "menu_event":
-                    if len(message["payload"]) > 0:
-                        self.__handle_slippstream_menu_event(base64.b64decode(message["payload"]), self._temp_gamestate)
-                        frame_ended = True
-
-                elif self._use_manual_bookends and message["type"] == "frame_end" and self._frame != -10000:
-                    frame_ended = True
+                frame_ended = self._handle_message(message)
+                event_decode += time.perf_counter_ns() - received
             else:
                 return None
+        # The client keeps track of its own parsing time, which is part of what we spent waiting on it
+        message_decode = getattr(self._slippstream, "decode_time", 0) - decode_time
+        timings.network.record(waiting - message_decode)
+        timings.message_decode.record(message_decode)
+        timings.event_decode.record(event_decode)
+
+        gamestate = self._finish_frame()
+        if self.wait_strategy is not None:
+            self.wait_strategy.frame_arrived()
+        if self._catch_up:
+            # Skip ahead past any frames that are already waiting
+            message = self._slippstream.dispatch(True)
+            while message:
+                if self._temp_gamestate is None:
+                    self._temp_gamestate = GameState()
+                if self._handle_message(message):
+                    gamestate = self._finish_frame()
+                    self.frames_dropped += 1
+                message = self._slippstream.dispatch(True)
+        self._step_end = time.perf_counter_ns()
+        timings.step.record(self._step_end - start)
+        return gamestate
+
+    async def aconnect(self):
+        """ Connects to the Slippi server (dolphin or wii), for use with astep()
+
+        The connection is serviced on a background I/O thread, so that waiting on the
+        console never blocks the event loop. Must be awaited from the loop that will call astep().
+
+        Returns:
+            True is successful, False otherwise
+        """
+        if not self.is_dolphin:
+            return self.connect()
+        if not isinstance(self._slippstream, AsyncSlippstreamClient):
+            self._slippstream = AsyncSlippstreamClient(self.slippi_address, self.slippi_port,
+                                                       reconnect_timeout=self._slippstream.reconnect_timeout)
+        return await self._slippstream.connect()
+
+    async def astep(self, timeout=None):
+        """ Like step(), but awaits the next frame instead of blocking on it
+
+        Use with aconnect(). Cancelling astep() (or having it time out) is safe: any part
+        of the frame that has already arrived is kept, and the next astep() picks up where
+        this one left off.
 
+        SLP files are read the same way as step() does. They never wait on the network.
+
+        Args:
+            timeout (float): Give up after this many seconds. None to wait forever
+
+        Returns:
+            GameState object that represents new current state of the game
+
+        Raises:
+            asyncio.TimeoutError: If the timeout runs out before the frame is done
+        """
+        if not isinstance(self._slippstream, AsyncSlippstreamClient):
+            return self.step()
+
+        self.processingtime = time.time() - self._frametimestamp
+
+        # Flush the controllers
+        for controler in self.controllers:
+            controler.flush()
+
+        if timeout is None:
+            return await self.__aread_frame()
+        return await asyncio.wait_for(self.__aread_frame(), timeout)
+
+    async def __aread_frame(self):
+        """Await messages until the current frame is done"""
+        if self._temp_gamestate is None:
+            self._temp_gamestate = GameState()
+
+        frame_ended = False
+        while not frame_ended:
+            message = await self._slippstream.dispatch(self._polling_mode)
+            if message:
+                frame_ended = self._handle_message(message)
+            else:
+                return None
+
+        gamestate = self._finish_frame()
+        if self._catch_up:
+            message = await self._slippstream.dispatch(True)
+            while message:
+                if self._temp_gamestate is None:
+                    self._temp_gamestate = GameState()
+                if self._handle_message(message):
+                    gamestate = self._finish_frame()
+                    self.frames_dropped += 1
+                message = await self._slippstream.dispatch(True)
+        return gamestate
+
+    def _handle_message(self, message):
+        """Apply one message from the slippstream to the in-progress gamestate
+
+        Returns:
+            bool: Whether the message finished off the frame
+        """
+        frame_ended = False
+        if "next_cursor" in message:
+            self.cursor = message["next_cursor"]
+
+        if message["type"] == "connect_reply":
+            self.connected = True
+            self.nick = message["nick"]
+            self.version = message["version"]
+            # If the server couldn't pick up right where we left off, a half-read frame is no good
+            if message["cursor"] != self.cursor:
+                self._temp_gamestate = GameState()
+            self.cursor = message["cursor"]
+
+        elif message["type"] == "game_event":
+            payload = message["payload"]
+            if len(payload) > 0:
+                # The client usually hands over payloads already decoded. Not always, though
+                if isinstance(payload, str):
+                    payload = base64.b64decode(payload)
+                frame_ended = self.__handle_slippstream_events(payload, self._temp_gamestate)
+
+        elif message["type"] == "menu_event":
+            payload = message["payload"]
+            if len(payload) > 0:
+                if isinstance(payload, str):
+                    payload = base64.b64decode(payload)
+                self.__handle_slippstream_menu_event(payload, self._temp_gamestate)
+                frame_ended = True
+
+        elif self._use_manual_bookends and message["type"] == "frame_end" and self._frame != -10000:
+            frame_ended = True
+        return frame_ended
+
+    def _finish_frame(self):
+        """Hand off the completed gamestate"""
+        start = time.perf_counter_ns()
         gamestate = self._temp_gamestate
         self._temp_gamestate = None
         self.__fixframeindexing(gamestate)
         self.__fixiasa(gamestate)
+        self.timings.fixups.record(time.perf_counter_ns() - start)
         # Start the processing timer now that we're done reading messages
         self._frametimestamp = time.time()
         return gamestate
 
+    def seek(self, frame):
+        """Jump to a frame of an SLP file, so that the next step() returns it
+
+        Only works when reading from SLP files. The first seek builds an index of where
+        every frame is in the file. (See the index_cache argument to keep it for next time)
+
+        Note:
+            Helpers that are tracked across frames (like invulnerability_left and
+            moonwalkwarning) start over from the frame you seek to.
+
+        Args:
+            frame (int): Frame number to jump to. If the replay doesn't have that exact frame,
+                the next one after it is used instead.
+
+        Returns:
+            int: The frame number that the next step() will return
+
+        Raises:
+            ValueError: If the frame is past the end of the replay
+        """
+        if self.is_dolphin:
+            raise ValueError("Can only seek within SLP files")
+        frame, offset = self._slippstream.frame_index().locate(frame)
+        # Read the game setup events, in case we haven't already
+        self.__handle_slippstream_events(self._slippstream.header(), GameState())
+        self._slippstream.seek(offset, frame)
+        self._frame = frame - 1
+        self._temp_gamestate = None
+        self._prev_gamestate = GameState()
+        return frame
+
+    def read_frames(self, start, stop):
+        """Decode just a range of frames from an SLP file
+
+        Args:
+            start (int): First frame to read
+            stop (int): Frame to stop at. (Not included)
+
+        Yields:
+            GameState: One for each frame from start up to stop
+        """
+        self.seek(start)
+        while True:
+            gamestate = self.step()
+            if gamestate is None or gamestate.frame >= stop:
+                return
+            yield gamestate
+
     def __handle_slippstream_events(self, event_bytes, gamestate):
-        """ Handle a series of events, provided sequentially in a byte array """
+        """ Handle a series of events, provided sequentially in a byte array
+
+        The buffer is never sliced up. We just walk an offset through it, and each
+        event is decoded in place.
+        """
         gamestate.menu_state = enums.Menu.IN_GAME
-        while len(event_bytes) > 0:
-            event_size = self.eventsize[event_bytes[0]]
-            if len(event_bytes) < event_size:
+        eventsize = self.eventsize
+        offset = 0
+        end = len(event_bytes)
+        while offset < end:
+            command = event_bytes[offset]
+            event_size = eventsize[command]
+            if end - offset < event_size:
                 print("WARNING: Something went wrong unpacking events. Data is probably missing")
                 print("\tDidn't have enough data for event")
                 return False
-            if EventType(event_bytes[0]) == EventType.PAYLOADS:
-                cursor = 0x2
-                payload_size = event_bytes[1]
-                num_commands = (payload_size - 1) // 3
-                for i in range(0, num_commands):
-                    command = np.ndarray((1,), ">B", event_bytes, cursor)[0]
-                    command_len = np.ndarray((1,), ">H", event_bytes, cursor + 0x1)[0]
-                    self.eventsize[command] = command_len+1
-                    cursor += 3
-                event_bytes = event_bytes[payload_size + 1:]
-
-            elif EventType(event_bytes[0]) == EventType.FRAME_START:
-                event_bytes = event_bytes[event_size:]
-
-            elif EventType(event_bytes[0]) == EventType.GAME_START:
-                self.__game_start(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
-
-            elif EventType(event_bytes[0]) == EventType.GAME_END:
-                event_bytes = event_bytes[event_size:]
-                return self._use_manual_bookends
-
-            elif EventType(event_bytes[0]) == EventType.PRE_FRAME:
-                self.__pre_frame(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
+            if command == _POST_FRAME:
+                self.__post_frame(gamestate, event_bytes, offset)
 
-            elif EventType(event_bytes[0]) == EventType.POST_FRAME:
-                self.__post_frame(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
+            elif command == _PRE_FRAME:
+                self.__pre_frame(gamestate, event_bytes, offset)
 
-            elif EventType(event_bytes[0]) == EventType.GECKO_CODES:
-                event_bytes = event_bytes[event_size:]
+            elif command == _ITEM_UPDATE:
+                self.__item_update(gamestate, event_bytes, offset)
 
-            elif EventType(event_bytes[0]) == EventType.FRAME_BOOKEND:
-                self.__frame_bookend(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
+            elif command == _FRAME_BOOKEND:
+                self.__frame_bookend(gamestate, event_bytes, offset)
                 # If this is an old frame, then don't return it.
                 if gamestate.frame <= self._frame:
                     return False
                 self._frame = gamestate.frame
                 return True
 
-            elif EventType(event_bytes[0]) == EventType.ITEM_UPDATE:
-                self.__item_update(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
+            elif command in (_FRAME_START, _GECKO_CODES):
+                pass
+
+            elif command == _PAYLOADS:
+                event_size = slp.read_payload_sizes(event_bytes, offset, eventsize)
+                self.__compile_layouts()
+
+            elif command == _GAME_START:
+                self.__game_start(gamestate, event_bytes, offset)
+
+            elif command == _GAME_END:
+                return self._use_manual_bookends
 
             else:
                 print("WARNING: Something went wrong unpacking events. " + \
                     "Data is probably missing")
-                print("\tGot invalid event type: ", event_bytes[0])
+                print("\tGot invalid event type: ", command)
                 return False
+            offset += event_size
         return False
 
-    def __game_start(self, gamestate, event_bytes):
+    def __compile_layouts(self):
+        """Compile struct decoders for the event sizes of this game
+
+        Event sizes only change between SLP versions, so the decision of which
+        fields exist is made here once per game rather than on every event.
+        """
+        layouts = slp.compile_layouts(self.eventsize)
+        self._pre_frame_layout = layouts[EventType.PRE_FRAME]
+        self._post_frame_layout = layouts[EventType.POST_FRAME]
+        self._item_update_layout = layouts[EventType.ITEM_UPDATE]
+
+    def __game_start(self, gamestate, event_bytes, offset):
         self._frame = -10000
-        major = np.ndarray((1,), ">B", event_bytes, 0x1)[0]
-        minor = np.ndarray((1,), ">B", event_bytes, 0x2)[0]
-        version_num = np.ndarray((1,), ">B", event_bytes, 0x3)[0]
-        self.slp_version = str(major) + "." + str(minor) + "." + str(version_num)
+        game_start = slp.parse_game_start(event_bytes, offset)
+        major = game_start["version"][0]
+        self.slp_version = game_start["slp_version"]
         self._use_manual_bookends = self._allow_old_version and (version.parse(self.slp_version) < version.parse("3.0.0"))
         if major < 3 and not self._allow_old_version:
             raise SlippiVersionTooLow(self.slp_version)
-        try:
-            self._current_stage = enums.to_internal_stage(np.ndarray((1,), ">H", event_bytes, 0x13)[0])
-        except ValueError:
-            self._current_stage = enums.Stage.NO_STAGE
-
-        for i in range(4):
-            self._costumes[i] = np.ndarray((1,), ">B", event_bytes, 0x68 + (0x24 * i))[0]
+        self._current_stage = game_start["stage"]
 
-        for i in range(4):
-            self._cpu_level[i] = np.ndarray((1,), ">B", event_bytes, 0x74 + (0x24 * i))[0]
+        for port, player in game_start["players"].items():
+            self._costumes[port-1] = player["costume"]
+            self._cpu_level[port-1] = player["cpu_level"]
 
-        for i in range(4):
-            if np.ndarray((1,), ">B", event_bytes, 0x66 + (0x24 * i))[0] != 1:
-                self._cpu_level[i] = 0
+    def __pre_frame(self, gamestate, event_bytes, offset):
+        (frame, port, _, main_x, main_y, c_x, c_y, buttonbits) = self._pre_frame_layout.unpack(event_bytes, offset)
 
-    def __pre_frame(self, gamestate, event_bytes):
         # Grab the physical controller state and put that into the controller state
-        controller_port = np.ndarray((1,), ">B", event_bytes, 0x5)[0] + 1
+        controller_port = port + 1
 
         if controller_port not in gamestate.player:
             gamestate.player[controller_port] = PlayerState()
@@ -401,107 +740,74 @@ class Console:
         playerstate.costume = self._costumes[controller_port-1]
         playerstate.cpu_level = self._cpu_level[controller_port-1]
 
-        main_x = (np.ndarray((1,), ">f", event_bytes, 0x19)[0] / 2) + 0.5
-        main_y = (np.ndarray((1,), ">f", event_bytes, 0x1D)[0] / 2) + 0.5
-        playerstate.controller_state.main_stick = (main_x, main_y)
-
-        c_x = (np.ndarray((1,), ">f", event_bytes, 0x21)[0] / 2) + 0.5
-        c_y = (np.ndarray((1,), ">f", event_bytes, 0x25)[0] / 2) + 0.5
-        playerstate.controller_state.c_stick = (c_x, c_y)
-
-        buttonbits = np.ndarray((1,), ">H", event_bytes, 0x31)[0]
-        playerstate.controller_state.button[enums.Button.BUTTON_A] = bool(int(buttonbits) & 0x0100)
-        playerstate.controller_state.button[enums.Button.BUTTON_B] = bool(int(buttonbits) & 0x0200)
-        playerstate.controller_state.button[enums.Button.BUTTON_X] = bool(int(buttonbits) & 0x0400)
-        playerstate.controller_state.button[enums.Button.BUTTON_Y] = bool(int(buttonbits) & 0x0800)
-        playerstate.controller_state.button[enums.Button.BUTTON_START] = bool(int(buttonbits) & 0x1000)
-        playerstate.controller_state.button[enums.Button.BUTTON_Z] = bool(int(buttonbits) & 0x0010)
-        playerstate.controller_state.button[enums.Button.BUTTON_R] = bool(int(buttonbits) & 0x0020)
-        playerstate.controller_state.button[enums.Button.BUTTON_L] = bool(int(buttonbits) & 0x0040)
-        playerstate.controller_state.button[enums.Button.BUTTON_D_LEFT] = bool(int(buttonbits) & 0x0001)
-        playerstate.controller_state.button[enums.Button.BUTTON_D_RIGHT] = bool(int(buttonbits) & 0x0002)
-        playerstate.controller_state.button[enums.Button.BUTTON_D_DOWN] = bool(int(buttonbits) & 0x0004)
-        playerstate.controller_state.button[enums.Button.BUTTON_D_UP] = bool(int(buttonbits) & 0x0008)
+        playerstate.controller_state.main_stick = ((main_x / 2) + 0.5, (main_y / 2) + 0.5)
+        playerstate.controller_state.c_stick = ((c_x / 2) + 0.5, (c_y / 2) + 0.5)
+
+        button = playerstate.controller_state.button
+        button[enums.Button.BUTTON_A] = bool(buttonbits & 0x0100)
+        button[enums.Button.BUTTON_B] = bool(buttonbits & 0x0200)
+        button[enums.Button.BUTTON_X] = bool(buttonbits & 0x0400)
+        button[enums.Button.BUTTON_Y] = bool(buttonbits & 0x0800)
+        button[enums.Button.BUTTON_START] = bool(buttonbits & 0x1000)
+        button[enums.Button.BUTTON_Z] = bool(buttonbits & 0x0010)
+        button[enums.Button.BUTTON_R] = bool(buttonbits & 0x0020)
+        button[enums.Button.BUTTON_L] = bool(buttonbits & 0x0040)
+        button[enums.Button.BUTTON_D_LEFT] = bool(buttonbits & 0x0001)
+        button[enums.Button.BUTTON_D_RIGHT] = bool(buttonbits & 0x0002)
+        button[enums.Button.BUTTON_D_DOWN] = bool(buttonbits & 0x0004)
+        button[enums.Button.BUTTON_D_UP] = bool(buttonbits & 0x0008)
         if self._use_manual_bookends:
             self._frame = gamestate.frame
 
-    def __post_frame(self, gamestate, event_bytes):
+    def __post_frame(self, gamestate, event_bytes, offset):
+        # Fields that are too new for this SLP version come back as their defaults
+        (frame, port, _, character, action, x, y, facing, percent, shield_strength, stock, action_frame,
+         bitflags2, hitstun_frames_left, airborne, jumps_left, hurtbox_status,
+         speed_air_x_self, speed_y_self, speed_x_attack, speed_y_attack, speed_ground_x_self,
+         ecb_top_x, ecb_top_y, ecb_bottom_x, ecb_bottom_y,
+         ecb_left_x, ecb_left_y, ecb_right_x, ecb_right_y) = self._post_frame_layout.unpack(event_bytes, offset)
+
         gamestate.stage = self._current_stage
-        gamestate.frame = np.ndarray((1,), ">i", event_bytes, 0x1)[0]
-        controller_port = np.ndarray((1,), ">B", event_bytes, 0x5)[0] + 1
+        gamestate.frame = frame
+        controller_port = port + 1
 
         if controller_port not in gamestate.player:
             gamestate.player[controller_port] = PlayerState()
 
         playerstate = gamestate.player[controller_port]
-        playerstate.x = np.ndarray((1,), ">f", event_bytes, 0xa)[0]
-        playerstate.y = np.ndarray((1,), ">f", event_bytes, 0xe)[0]
+        playerstate.x = x
+        playerstate.y = y
 
-        playerstate.character = enums.Character(np.ndarray((1,), ">B", event_bytes, 0x7)[0])
+        playerstate.character = enums.Character(character)
         try:
-            playerstate.action = enums.Action(np.ndarray((1,), ">H", event_bytes, 0x8)[0])
+            playerstate.action = enums.Action(action)
         except ValueError:
             playerstate.action = enums.Action.UNKNOWN_ANIMATION
 
         # Melee stores this in a float for no good reason. So we have to convert
-        playerstate.facing = np.ndarray((1,), ">f", event_bytes, 0x12)[0] > 0
+        playerstate.facing = facing > 0
 
-        playerstate.percent = int(np.ndarray((1,), ">f", event_bytes, 0x16)[0])
-        playerstate.shield_strength = np.ndarray((1,), ">f", event_bytes, 0x1A)[0]
-        playerstate.stock = np.ndarray((1,), ">B", event_bytes, 0x21)[0]
-        playerstate.action_frame = int(np.ndarray((1,), ">f", event_bytes, 0x22)[0])
+        playerstate.percent = int(percent)
+        playerstate.shield_strength = shield_strength
+        playerstate.stock = stock
+        playerstate.action_frame = int(action_frame)
 
         # Extract the bit at mask 0x20
-        try:
-            bitflags2 = np.ndarray((1,), ">B", event_bytes, 0x27)[0]
-            playerstate.hitlag = bool(bitflags2 & 0x20)
-        except TypeError:
-            playerstate.hitlag = False
+        playerstate.hitlag = bool(bitflags2 & 0x20)
 
         try:
-            playerstate.hitstun_frames_left = int(np.ndarray((1,), ">f", event_bytes, 0x2B)[0])
-        except TypeError:
-            playerstate.hitstun_frames_left = 0
-        except ValueError:
+            playerstate.hitstun_frames_left = int(hitstun_frames_left)
+        except (ValueError, OverflowError):
             playerstate.hitstun_frames_left = 0
-        try:
-            playerstate.on_ground = not bool(np.ndarray((1,), ">B", event_bytes, 0x2F)[0])
-        except TypeError:
-            playerstate.on_ground = True
-        try:
-            playerstate.jumps_left = np.ndarray((1,), ">B", event_bytes, 0x32)[0]
-        except TypeError:
-            playerstate.jumps_left = 1
-
-        try:
-            playerstate.invulnerable = int(np.ndarray((1,), ">B", event_bytes, 0x34)[0]) != 0
-        except TypeError:
-            playerstate.invulnerable = False
+        playerstate.on_ground = not bool(airborne)
+        playerstate.jumps_left = jumps_left
+        playerstate.invulnerable = hurtbox_status != 0
 
-        try:
-            playerstate.speed_air_x_self = np.ndarray((1,), ">f", event_bytes, 0x35)[0]
-        except TypeError:
-            playerstate.speed_air_x_self = 0
-
-        try:
-            playerstate.speed_y_self = np.ndarray((1,), ">f", event_bytes, 0x39)[0]
-        except TypeError:
-            playerstate.speed_y_self = 0
-
-        try:
-            playerstate.speed_x_attack = np.ndarray((1,), ">f", event_bytes, 0x3D)[0]
-        except TypeError:
-            playerstate.speed_x_attack = 0
-
-        try:
-            playerstate.speed_y_attack = np.ndarray((1,), ">f", event_bytes, 0x41)[0]
-        except TypeError:
-            playerstate.speed_y_attack = 0
-
-        try:
-            playerstate.speed_ground_x_self = np.ndarray((1,), ">f", event_bytes, 0x45)[0]
-        except TypeError:
-            playerstate.speed_ground_x_self = 0
+        playerstate.speed_air_x_self = speed_air_x_self
+        playerstate.speed_y_self = speed_y_self
+        playerstate.speed_x_attack = speed_x_attack
+        playerstate.speed_y_attack = speed_y_attack
+        playerstate.speed_ground_x_self = speed_ground_x_self
 
         # Keep track of a player's invulnerability due to respawn or ledge grab
         if controller_port in self._prev_gamestate.player:
@@ -534,65 +840,15 @@ class Console:
         except KeyError:
             playerstate.off_stage = False
 
-        # ECB top edge, x
-        ecb_top_x = 0
-        ecb_top_y = 0
-        try:
-            ecb_top_x = np.ndarray((1,), ">f", event_bytes, 0x49)[0]
-        except TypeError:
-            ecb_top_x = 0
-        # ECB Top edge, y
-        try:
-            ecb_top_y = np.ndarray((1,), ">f", event_bytes, 0x4D)[0]
-        except TypeError:
-            ecb_top_y = 0
+        # ECB edges. (x, y) offsets from the player's center
         playerstate.ecb_top = (ecb_top_x, ecb_top_y)
-
-        # ECB bottom edge, x coord
-        ecb_bot_x = 0
-        ecb_bot_y = 0
-        try:
-            ecb_bot_x = np.ndarray((1,), ">f", event_bytes, 0x51)[0]
-        except TypeError:
-            ecb_bot_x = 0
-        # ECB Bottom edge, y coord
-        try:
-            ecb_bot_y = np.ndarray((1,), ">f", event_bytes, 0x55)[0]
-        except TypeError:
-            ecb_bot_y = 0
-        playerstate.ecb_bottom = (ecb_bot_x, ecb_bot_y)
-
-        # ECB left edge, x coord
-        ecb_left_x = 0
-        ecb_left_y = 0
-        try:
-            ecb_left_x = np.ndarray((1,), ">f", event_bytes, 0x59)[0]
-        except TypeError:
-            ecb_left_x = 0
-        # ECB left edge, y coord
-        try:
-            ecb_left_y = np.ndarray((1,), ">f", event_bytes, 0x5D)[0]
-        except TypeError:
-            ecb_left_y = 0
+        playerstate.ecb_bottom = (ecb_bottom_x, ecb_bottom_y)
         playerstate.ecb_left = (ecb_left_x, ecb_left_y)
-
-        # ECB right edge, x coord
-        ecb_right_x = 0
-        ecb_right_y = 0
-        try:
-            ecb_right_x = np.ndarray((1,), ">f", event_bytes, 0x61)[0]
-        except TypeError:
-            ecb_right_x = 0
-        # ECB right edge, y coord
-        try:
-            ecb_right_y = np.ndarray((1,), ">f", event_bytes, 0x65)[0]
-        except TypeError:
-            ecb_right_y = 0
         playerstate.ecb_right = (ecb_right_x, ecb_right_y)
         if self._use_manual_bookends:
             self._frame = gamestate.frame
 
-    def __frame_bookend(self, gamestate, event_bytes):
+    def __frame_bookend(self, gamestate, event_bytes, offset):
         self._prev_gamestate = gamestate
         # Calculate helper distance variable
         #   This is a bit kludgey.... :/
@@ -608,20 +864,18 @@ class Console:
         ydist = player_one_y - player_two_y
         gamestate.distance = math.sqrt((xdist**2) + (ydist**2))
 
-    def __item_update(self, gamestate, event_bytes):
+    def __item_update(self, gamestate, event_bytes, offset):
+        (_, subtype, x_speed, y_speed, x, y, owner) = self._item_update_layout.unpack(event_bytes, offset)
         projectile = Projectile()
-        projectile.x = np.ndarray((1,), ">f", event_bytes, 0x14)[0]
-        projectile.y = np.ndarray((1,), ">f", event_bytes, 0x18)[0]
-        projectile.x_speed = np.ndarray((1,), ">f", event_bytes, 0xc)[0]
-        projectile.y_speed = np.ndarray((1,), ">f", event_bytes, 0x10)[0]
-        try:
-            projectile.owner = np.ndarray((1,), ">B", event_bytes, 0x2A)[0] + 1
-            if projectile.owner > 4:
-                projectile.owner = -1
-        except TypeError:
+        projectile.x = x
+        projectile.y = y
+        projectile.x_speed = x_speed
+        projectile.y_speed = y_speed
+        projectile.owner = owner + 1
+        if projectile.owner > 4:
             projectile.owner = -1
         try:
-            projectile.subtype = enums.ProjectileSubtype(np.ndarray((1,), ">H", event_bytes, 0x5)[0])
+            projectile.subtype = enums.ProjectileSubtype(subtype)
         except ValueError:
             projectile.subtype = enums.ProjectileSubtype.UNKNOWN_PROJECTILE
         # Add the projectile to the gamestate list
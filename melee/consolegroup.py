@@ -0,0 +1,225 @@
+"""Drive many consoles from one process
+
+A ConsoleGroup services the Slippstream connections of a whole batch of Dolphin
+instances with a single enet host, and hands back frames from whichever ones
+are ready. Handy for feeding one batched policy from lots of emulators.
+"""
+
+import select
+import time
+
+import enet
+
+from melee.gamestate import GameState
+from melee.slippstream import parse_message, SlippstreamClient
+
+class _GroupedClient(SlippstreamClient):
+    """Stands in for a Console's own SlippstreamClient, once a ConsoleGroup has taken it over
+
+    It keeps track of the cursor, reconnects and the end of the game just like any other
+    client. But it connects through the group's host, and the group does the reading.
+    """
+    def __init__(self, client, host):
+        super().__init__(client.address, client.port, client.realtime, client.reconnect_timeout,
+                         client.max_backoff, host=host)
+        self.cursor = client.cursor
+
+    def connect(self):
+        return True
+
+    def dispatch(self, polling_mode):
+        """Messages are read by the group, not the console"""
+        return None
+
+    def shutdown(self):
+        self._retry_at = None
+        if self._peer is not None:
+            self._peer.disconnect()
+            self._peer = None
+        return False
+
+class ConsoleGroup:
+    """A batch of consoles sharing one Slippstream connection loop
+
+    Example:
+        consoles = [melee.Console(path=dolphin, slippi_port=51441 + i) for i in range(16)]
+        group = melee.ConsoleGroup(consoles)
+        group.connect()
+        while True:
+            gamestates = group.step_all()
+            ...
+    """
+    def __init__(self, consoles):
+        """Create a group
+
+        Args:
+            consoles (list of Console): The consoles to drive. They must all be Dolphin / Wii
+                consoles (not SLP files). Don't call their own connect() or step(). The group
+                does that for them. If a connection drops, it's picked back up according to
+                the console's reconnect_timeout
+
+        Raises:
+            ValueError: If one of the consoles isn't a Dolphin / Wii console
+        """
+        self.consoles = list(consoles)
+        """(list of Console): Every console in the group"""
+        for console in self.consoles:
+            if not console.is_dolphin:
+                raise ValueError("Only Dolphin / Wii consoles can be grouped, not SLP files")
+        self._host = enet.Host(None, len(self.consoles), 0, 0)
+        # Console of each connection, by its slot in the enet host
+        self._members = {}
+        # Newest finished gamestate of each console, not handed out yet
+        self._ready = {}
+        # Consoles whose controllers need flushing before their next frame
+        self._to_flush = []
+
+    def connect(self):
+        """Connect to every console
+
+        Returns:
+            True is successful, False otherwise
+        """
+        for console in self.consoles:
+            client = console._slippstream
+            if isinstance(client, _GroupedClient):
+                continue
+            # Each console came with its own client. Close it, so we don't hold on to a socket per console
+            client.shutdown()
+            console._slippstream = _GroupedClient(client, self._host)
+            self._connect(console)
+        return True
+
+    def _connect(self, console):
+        """Start connecting (or reconnecting) to one console"""
+        client = console._slippstream
+        client._connect_peer()
+        self._members[client._peer.incomingPeerID] = console
+
+    def stop(self):
+        """Shut down every console in the group"""
+        for console in self.consoles:
+            console.stop()
+            console._slippstream.shutdown()
+        self._host.flush()
+
+    def _service(self, wait_time):
+        """Handle every event that's come in, waiting up to wait_time ms for the first one
+
+        Returns:
+            bool: False once every console has disconnected
+        """
+        # Reconnect to any console whose retry is due, and don't wait past the next one
+        now = time.monotonic()
+        for console in self.consoles:
+            client = console._slippstream
+            if client._retry_at is None:
+                continue
+            if client._retry_at <= now:
+                client._retry_at = None
+                self._connect(console)
+            else:
+                wait_time = min(wait_time, int((client._retry_at - now) * 1000) + 1)
+        event = self._host.service(0)
+        if event.type == enet.EVENT_TYPE_NONE and wait_time > 0:
+            # pyenet holds on to the GIL while it waits inside service(), so wait in select() instead
+            select.select([self._host.socket.fileno()], [], [], wait_time / 1000)
+            event = self._host.service(0)
+        while event.type != enet.EVENT_TYPE_NONE:
+            console = self._members.get(event.peer.incomingPeerID)
+            if console is not None:
+                if event.type == enet.EVENT_TYPE_RECEIVE:
+                    self._receive(console, event.packet.data)
+                elif event.type == enet.EVENT_TYPE_CONNECT:
+                    # Asks to pick up from the console's cursor, so a reconnect carries on where it left off
+                    console._slippstream._send_handshake()
+                elif event.type == enet.EVENT_TYPE_DISCONNECT:
+                    del self._members[event.peer.incomingPeerID]
+                    # Schedules a reconnect, or gives up (see the console's reconnect_timeout)
+                    console._slippstream._disconnected()
+            event = self._host.service(0)
+        return not all(console._slippstream.disconnected for console in self.consoles)
+
+    def _receive(self, console, data):
+        """Hand one message to the console it came from"""
+        # Empty packets show up at the end of a game for some reason
+        if len(data) == 0:
+            return
+        message = parse_message(data)
+        if message is None:
+            return
+        console._slippstream._received(message)
+        if console._temp_gamestate is None:
+            console._temp_gamestate = GameState()
+        if console._handle_message(message):
+            if console in self._ready:
+                console.frames_dropped += 1
+            self._ready[console] = console._finish_frame()
+
+    def _flush(self):
+        """Send the inputs for the consoles we handed frames out for last time"""
+        for console in self._to_flush:
+            console.processingtime = time.time() - console._frametimestamp
+            for controller in console.controllers:
+                controller.flush()
+        self._to_flush = []
+
+    def _take(self, consoles):
+        """Hand out the ready frames of the given consoles"""
+        gamestates = {}
+        for console in consoles:
+            gamestates[console] = self._ready.pop(console)
+        self._to_flush = list(gamestates)
+        return gamestates
+
+    def step(self, timeout=None):
+        """Wait for at least one console to finish a frame
+
+        Controllers of the consoles returned last time get flushed first, like Console.step()
+        does. If a console finishes more than one frame before it's picked up, only the newest
+        is returned, and the rest are counted in its frames_dropped.
+
+        Args:
+            timeout (float): Give up after this many seconds. None to wait forever
+
+        Returns:
+            dict: GameState of each Console that has a new frame. Empty if the timeout ran out.
+                None once every console has disconnected
+        """
+        self._flush()
+        deadline = None if timeout is None else time.time() + timeout
+        connected = self._service(0)
+        while not self._ready:
+            if not connected:
+                return None
+            wait_time = 1000
+            if deadline is not None:
+                wait_time = int(max(0, deadline - time.time()) * 1000)
+                if wait_time == 0:
+                    break
+            connected = self._service(min(wait_time, 1000))
+        return self._take(list(self._ready))
+
+    def step_all(self, timeout=None):
+        """Wait for every console to finish a frame
+
+        Args:
+            timeout (float): Give up after this many seconds. None to wait forever
+
+        Returns:
+            dict: GameState of each Console that's still connected. If the timeout runs out
+                first, only the consoles that were ready. None once every console has disconnected
+        """
+        self._flush()
+        deadline = None if timeout is None else time.time() + timeout
+        connected = self._service(0)
+        while any(console not in self._ready and not console._slippstream.disconnected for console in self.consoles):
+            wait_time = 1000
+            if deadline is not None:
+                wait_time = int(max(0, deadline - time.time()) * 1000)
+                if wait_time == 0:
+                    break
+            connected = self._service(min(wait_time, 1000))
+        if not connected and not self._ready:
+            return None
+        return self._take(list(self._ready))
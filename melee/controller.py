@@ -2,8 +2,9 @@
 
 import platform
 import sys
-import copy
+import os
 import time
+import numpy as np
 try:
     import win32file
     import pywintypes
@@ -11,6 +12,64 @@ except ImportError:
     pass
 
 from melee import enums
+from melee.latency import LatencyHistogram
+
+# The GameCube stick reports a byte per axis: 128 is neutral, and it reaches 127 either way
+#   So there are only 255 distinct positions, raw = 128 + (2 * value - 1) * 127
+_STICK_CENTER = 128
+_STICK_RADIUS = 127
+
+def _stick_raw(value):
+    """The stick byte closest to a 0 -> 1 value"""
+    raw = int(value * 254 + 1.5)
+    if raw < 1:
+        return 1
+    if raw > 255:
+        return 255
+    return raw
+
+def _shoulder_raw(value):
+    """The shoulder byte closest to a 0 -> 1 value"""
+    raw = int(value * 255 + 0.5)
+    if raw < 0:
+        return 0
+    if raw > 255:
+        return 255
+    return raw
+
+# Value of each stick and shoulder byte, and how it's written to the pipe
+_STICK_VALUES = [0.5 + (raw - _STICK_CENTER) / (2 * _STICK_RADIUS) for raw in range(256)]
+_SHOULDER_VALUES = [raw / 255 for raw in range(256)]
+_STICK_STRINGS = [str(value) for value in _STICK_VALUES]
+_STICK_PREFIXES = {stick: ["SET " + stick.value + " " + string + " " for string in _STICK_STRINGS]
+                   for stick in (enums.Button.BUTTON_MAIN, enums.Button.BUTTON_C)}
+_STICK_SUFFIXES = [string + "\n" for string in _STICK_STRINGS]
+_SHOULDER_COMMANDS = {shoulder: ["SET " + shoulder.value + " " + str(value) + "\n" for value in _SHOULDER_VALUES]
+                      for shoulder in (enums.Button.BUTTON_L, enums.Button.BUTTON_R)}
+# What each stick and shoulder's commands are filed under, until flush()
+_SET_KEYS = {button: "SET " + button.value for button in list(_STICK_PREFIXES) + list(_SHOULDER_COMMANDS)}
+
+def quantize_stick(value):
+    """Snap a stick axis to the nearest position a real GameCube stick can report
+
+    Args:
+        value (float): Ranges from 0 -> 1, 0.5 is neutral
+
+    Returns:
+        float: The nearest of the stick's 255 positions
+    """
+    return _STICK_VALUES[_stick_raw(value)]
+
+def quantize_shoulder(value):
+    """Snap a shoulder press to the nearest amount a real GameCube controller can report
+
+    Args:
+        value (float): Ranges from 0 (not pressed) to 1 (fully pressed)
+
+    Returns:
+        float: The nearest of the shoulder's 256 amounts
+    """
+    return _SHOULDER_VALUES[_shoulder_raw(value)]
 
 class ControllerState:
     """A snapshot of the state of a virtual controller"""
@@ -54,6 +113,144 @@ class ControllerState:
         string += "R_SHOULDER: " + str(self.r_shoulder) + "\n"
         return string
 
+def state_commands(state):
+    """Work out the pipe commands that set every input of a controller to match a state
+
+    Handy for inputs you know ahead of time: work the commands out once, and hand them to
+    Controller.apply_state() every time. Sticks and shoulders are snapped to the positions a
+    real controller can report. (See quantize_stick() and quantize_shoulder())
+
+    Args:
+        state (ControllerState): The inputs
+
+    Returns:
+        dict: The commands
+    """
+    commands = {}
+    for item in enums.Button:
+        if item in (enums.Button.BUTTON_MAIN, enums.Button.BUTTON_C):
+            continue
+        commands[item.value] = ("PRESS " if state.button.get(item) else "RELEASE ") + item.value + "\n"
+    for stick, (x, y) in ((enums.Button.BUTTON_MAIN, state.main_stick), (enums.Button.BUTTON_C, state.c_stick)):
+        commands[_SET_KEYS[stick]] = _STICK_PREFIXES[stick][_stick_raw(x)] + _STICK_SUFFIXES[_stick_raw(y)]
+    for shoulder, amount in ((enums.Button.BUTTON_L, state.l_shoulder), (enums.Button.BUTTON_R, state.r_shoulder)):
+        commands[_SET_KEYS[shoulder]] = _SHOULDER_COMMANDS[shoulder][_shoulder_raw(amount)]
+    return commands
+
+_NEUTRAL_COMMANDS = state_commands(ControllerState())
+
+# Buttons, in the order of their bits in InputHistory.buttons
+_HISTORY_BUTTONS = (enums.Button.BUTTON_A, enums.Button.BUTTON_B, enums.Button.BUTTON_X, enums.Button.BUTTON_Y,
+                    enums.Button.BUTTON_Z, enums.Button.BUTTON_L, enums.Button.BUTTON_R, enums.Button.BUTTON_START,
+                    enums.Button.BUTTON_D_UP, enums.Button.BUTTON_D_DOWN, enums.Button.BUTTON_D_LEFT,
+                    enums.Button.BUTTON_D_RIGHT)
+_HISTORY_BITS = {button: 1 << bit for bit, button in enumerate(_HISTORY_BUTTONS)}
+
+class InputHistory:
+    """The last few frames of inputs a controller sent, in a fixed-size ring
+
+    Everything is stored in preallocated arrays, so recording a frame doesn't allocate
+    anything. The query methods hand back arrays in order, oldest frame first.
+
+    Example:
+        history = controller.history
+        if history.frames_since_pressed(melee.Button.BUTTON_A) > 10:
+            ...
+        recent_x = history.main_stick[-30:, 0]
+    """
+    def __init__(self, size=600):
+        """
+        Args:
+            size (int): How many frames to remember
+        """
+        self.size = size
+        self._buttons = np.zeros(size, dtype=np.uint16)
+        self._sticks = np.zeros((size, 4), dtype=np.float32)
+        self._shoulders = np.zeros((size, 2), dtype=np.float32)
+        self.count = 0
+        """(int): Total frames ever recorded. The ring only holds the last size of them"""
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def record(self, state):
+        """Add a frame of input
+
+        Args:
+            state (ControllerState): The inputs sent this frame
+        """
+        index = self.count % self.size
+        buttons = 0
+        for button, pressed in state.button.items():
+            if pressed:
+                buttons |= _HISTORY_BITS.get(button, 0)
+        self._buttons[index] = buttons
+        sticks = self._sticks[index]
+        sticks[0], sticks[1] = state.main_stick
+        sticks[2], sticks[3] = state.c_stick
+        shoulders = self._shoulders[index]
+        shoulders[0] = state.l_shoulder
+        shoulders[1] = state.r_shoulder
+        self.count += 1
+
+    def clear(self):
+        """Forget every frame"""
+        self.count = 0
+
+    def _ordered(self, array):
+        """The filled part of a ring array, oldest first"""
+        if self.count <= self.size:
+            return array[:self.count]
+        start = self.count % self.size
+        return np.concatenate((array[start:], array[:start]))
+
+    @property
+    def buttons(self):
+        """(np.ndarray of uint16): Button bitmask of each frame. Bits are A, B, X, Y, Z, L, R, START,
+        D_UP, D_DOWN, D_LEFT, D_RIGHT, from the lowest"""
+        return self._ordered(self._buttons)
+
+    @property
+    def main_stick(self):
+        """(np.ndarray of float32): (x, y) of the main stick each frame"""
+        return self._ordered(self._sticks)[:, 0:2]
+
+    @property
+    def c_stick(self):
+        """(np.ndarray of float32): (x, y) of the C stick each frame"""
+        return self._ordered(self._sticks)[:, 2:4]
+
+    @property
+    def shoulders(self):
+        """(np.ndarray of float32): (L, R) analog press each frame"""
+        return self._ordered(self._shoulders)
+
+    def pressed(self, button):
+        """Whether a button was held, each frame
+
+        Args:
+            button (enums.Button): The button
+
+        Returns:
+            np.ndarray of bool
+        """
+        return (self.buttons & _HISTORY_BITS[button]) != 0
+
+    def frames_since_pressed(self, button):
+        """How long ago a button was last held
+
+        Args:
+            button (enums.Button): The button
+
+        Returns:
+            int: 0 if it was held in the newest frame, 1 if the one before, and so on. None if it
+                wasn't held at all in the frames we remember
+        """
+        held = np.flatnonzero(self.pressed(button))
+        if len(held) == 0:
+            return None
+        return len(self) - 1 - int(held[-1])
+
 class Controller:
     """Manages virtual controller state and button presses
 
@@ -61,13 +258,24 @@ class Controller:
     buttons programatically, but also automatically configuring the controller with dolphin
     """
 
-    def __init__(self, console, port, type=enums.ControllerType.STANDARD):
+    def __init__(self, console, port, type=enums.ControllerType.STANDARD, quantize=False, history_size=600,
+                 nonblocking=False):
         """Create a new virtual controller
 
         Args:
             console (console.Console): A console object to attach the controller to
             port (int): Which controller port to plug into. Must be 1-4.
             type (enums.ControllerType): The type of controller this is
+            quantize (bool): Snap stick and shoulder values to the positions a real controller
+                can actually report. (See quantize_stick() and quantize_shoulder()) The same
+                inputs then always come out exactly the same, and the pipe commands come
+                straight out of a table instead of being formatted each time
+            history_size (int): How many frames of sent inputs to remember in history
+            nonblocking (bool): Never let a write to Dolphin hold up the bot. If Dolphin isn't
+                keeping up with its pipe, whatever doesn't fit waits for the next flush(). If
+                it still hasn't gone by then, the frames waiting are merged into one frame of
+                the whole controller state, so the backlog never grows past a frame. (See
+                stalls, frames_coalesced and write_latency) Linux and OSX only
         """
         self._is_dolphin = console.is_dolphin
         if self._is_dolphin:
@@ -76,10 +284,40 @@ class Controller:
 
         self.port = port
         self.prev = ControllerState()
+        """(ControllerState): The inputs sent at the last flush()"""
         self.current = ControllerState()
+        """(ControllerState): The inputs for this frame, so far"""
+        self.history = InputHistory(history_size)
+        """(InputHistory): The inputs sent over the last few frames"""
         self.logger = console.logger
         self._console = console
         self._type = type
+        self.quantize = quantize
+        # Commands for this frame, by the input they set. Only sent at flush()
+        self._pending = {}
+        # The last command actually sent for each input, so unchanged ones can be skipped
+        self._sent = {}
+        self.bytes_written = 0
+        """(int): Total bytes written to the pipe"""
+        self.writes = 0
+        """(int): Total writes to the pipe (each one is a system call)"""
+        self.flushes = 0
+        """(int): How many frames of input have been flushed"""
+        self.frame_bytes = 0
+        """(int): Bytes written by the last flush()"""
+        self.frame_writes = 0
+        """(int): Writes to the pipe made by the last flush()"""
+        self.write_latency = LatencyHistogram()
+        """(latency.LatencyHistogram): How long each flush() spent writing to the pipe"""
+        self.stalls = 0
+        """(int): With nonblocking, how many flushes couldn't write everything because the pipe was full"""
+        self.frames_coalesced = 0
+        """(int): With nonblocking, frames that were merged into a later one, rather than sent on their own"""
+        self._nonblocking = nonblocking and platform.system() != "Windows"
+        # With nonblocking, what's still waiting to be written
+        self._outbox = b""
+        # Whether the bytes written so far stop part way through a command
+        self._mid_command = False
 
         # Configure our controller with the console
         self._console.setup_dolphin_controller(port, type)
@@ -95,6 +333,8 @@ class Controller:
             self._console.controllers.append(self)
 
             if self._is_dolphin:
+                # A fresh pipe doesn't know about anything we sent before
+                self._sent = {}
                 if platform.system() == "Windows":
                     # Windows can take a little while to actually make the pipes
                     #   So keep trying a few times to connect to it
@@ -115,7 +355,13 @@ class Controller:
                         except pywintypes.error:
                             time.sleep(1)
                 else:
-                    self.pipe = open(self.pipe_path, "w")
+                    # Unbuffered, so that each flush() is exactly one write
+                    self.pipe = open(self.pipe_path, "wb", buffering=0)
+                    # Opening still waits for Dolphin. It's only the writes that don't
+                    if self._nonblocking:
+                        os.set_blocking(self.pipe.fileno(), False)
+                        self._outbox = b""
+                        self._mid_command = False
                 return True
             else:
                 return True
@@ -175,10 +421,7 @@ class Controller:
         if self._is_dolphin:
             if not self.pipe:
                 return
-            command = "PRESS " + str(button.value) + "\n"
-            if self.logger:
-                self.logger.log("Buttons Pressed", command, concat=True)
-            self._write(command)
+            self._queue(str(button.value), "PRESS " + str(button.value) + "\n")
 
     def release_button(self, button):
         """Release a single button
@@ -192,10 +435,7 @@ class Controller:
         if self._is_dolphin:
             if not self.pipe:
                 return
-            command = "RELEASE " + str(button.value) + "\n"
-            if self.logger:
-                self.logger.log("Buttons Pressed", command, concat=True)
-            self._write(command)
+            self._queue(str(button.value), "RELEASE " + str(button.value) + "\n")
 
     def press_shoulder(self, button, amount):
         """Press the analog shoulder buttons to a given amount
@@ -209,6 +449,11 @@ class Controller:
             as normal button presses. Pressing the shoulder all the way in
             will not cause the digital button to press
         """
+        command = None
+        if self.quantize and button in _SHOULDER_COMMANDS:
+            raw = _shoulder_raw(amount)
+            amount = _SHOULDER_VALUES[raw]
+            command = _SHOULDER_COMMANDS[button][raw]
         if button == enums.Button.BUTTON_L:
             self.current.l_shoulder = amount
         elif button == enums.Button.BUTTON_R:
@@ -216,10 +461,10 @@ class Controller:
         if self._is_dolphin:
             if not self.pipe:
                 return
-            command = "SET " + str(button.value) + " " + str(amount) + "\n"
-            if self.logger:
-                self.logger.log("Buttons Pressed", command, concat=True)
-            self._write(command)
+            if command is not None:
+                self._queue(_SET_KEYS[button], command)
+                return
+            self._queue("SET " + str(button.value), "SET " + str(button.value) + " " + str(amount) + "\n")
 
     def tilt_analog(self, button, x, y):
         """ Tilt one of the analog sticks to a given (x,y) value
@@ -229,6 +474,9 @@ class Controller:
             x (float): Ranges between 0 (left) and 1 (right)
             y (float): Ranges between 0 (down) and 1 (up)
         """
+        if self.quantize and button in _STICK_PREFIXES:
+            self._tilt_quantized(button, _stick_raw(x), _stick_raw(y), False)
+            return
         if button == enums.Button.BUTTON_MAIN:
             self.current.main_stick = (x, y)
         else:
@@ -236,10 +484,7 @@ class Controller:
         if self._is_dolphin:
             if not self.pipe:
                 return
-            command = "SET " + str(button.value) + " " + str(x) + " " + str(y) + "\n"
-            if self.logger:
-                self.logger.log("Buttons Pressed", command, concat=True)
-            self._write(command)
+            self._queue("SET " + str(button.value), "SET " + str(button.value) + " " + str(x) + " " + str(y) + "\n")
 
     def tilt_analog_unit(self, button, x, y):
         """ Tilt one of the analog sticks to a given (x,y) value, normalized to a unit vector
@@ -252,6 +497,9 @@ class Controller:
             x (float): Ranges between -1 (left) and 1 (right)
             y (float): Ranges between -1 (down) and 1 (up)
         """
+        if self.quantize and button in _STICK_PREFIXES:
+            self._tilt_quantized(button, _stick_raw((x/2) + 0.5), _stick_raw((y/2) + 0.5), True)
+            return
         if button == enums.Button.BUTTON_MAIN:
             self.current.main_stick = (x, y)
         else:
@@ -259,10 +507,22 @@ class Controller:
         if self._is_dolphin:
             if not self.pipe:
                 return
-            command = "SET " + str(button.value) + " " + str((x/2) + 0.5) + " " + str((y/2) + 0.5) + "\n"
-            if self.logger:
-                self.logger.log("Buttons Pressed", command, concat=True)
-            self._write(command)
+            self._queue("SET " + str(button.value),
+                        "SET " + str(button.value) + " " + str((x/2) + 0.5) + " " + str((y/2) + 0.5) + "\n")
+
+    def _tilt_quantized(self, button, raw_x, raw_y, unit):
+        """Tilt a stick to the given stick bytes, with the command from the table"""
+        x, y = _STICK_VALUES[raw_x], _STICK_VALUES[raw_y]
+        if unit:
+            x, y = 2 * x - 1, 2 * y - 1
+        if button == enums.Button.BUTTON_MAIN:
+            self.current.main_stick = (x, y)
+        else:
+            self.current.c_stick = (x, y)
+        if self._is_dolphin:
+            if not self.pipe:
+                return
+            self._queue(_SET_KEYS[button], _STICK_PREFIXES[button][raw_x] + _STICK_SUFFIXES[raw_y])
 
     # Left around for compat reasons. Might disappear at any time
     #   left undocumented. Just use release_all()
@@ -294,50 +554,122 @@ class Controller:
         if self._is_dolphin:
             if not self.pipe:
                 return
-            command = "RELEASE A" + "\n"
-            command += "RELEASE B" + "\n"
-            command += "RELEASE X" + "\n"
-            command += "RELEASE Y" + "\n"
-            command += "RELEASE Z" + "\n"
-            command += "RELEASE L" + "\n"
-            command += "RELEASE R" + "\n"
-            command += "RELEASE START" + "\n"
-            command += "RELEASE D_UP" + "\n"
-            command += "RELEASE D_DOWN" + "\n"
-            command += "RELEASE D_LEFT" + "\n"
-            command += "RELEASE D_RIGHT" + "\n"
-            command += "SET MAIN .5 .5" + "\n"
-            command += "SET C .5 .5" + "\n"
-            command += "SET L 0" + "\n"
-            command += "SET R 0" + "\n"
-            #Send the presses to dolphin
-            self._write(command)
+            self._pending.update(_NEUTRAL_COMMANDS)
             if self.logger:
                 self.logger.log("Buttons Pressed", "Empty Input", concat=True)
 
+    def apply_state(self, state, commands=None):
+        """Set every input at once, to match a controller state
+
+        Args:
+            state (ControllerState): The inputs to hold
+            commands (dict): The state's commands, from state_commands(). Pass these in when
+                applying the same state over and over, so they're only worked out once.
+                None to work them out here
+        """
+        current = self.current
+        current.button.update(state.button)
+        current.main_stick = state.main_stick
+        current.c_stick = state.c_stick
+        current.l_shoulder = state.l_shoulder
+        current.r_shoulder = state.r_shoulder
+        if self._is_dolphin and self.pipe:
+            if commands is None:
+                commands = state_commands(state)
+            self._pending.update(commands)
+
+    def _queue(self, key, command):
+        """Hold on to a command until flush(). A later command for the same input replaces it"""
+        self._pending[key] = command
+        if self.logger:
+            self.logger.log("Buttons Pressed", command, concat=True)
+
     def _write(self, command):
         """ Platform independent button write function.
         """
+        data = command.encode()
         if platform.system() == "Windows":
             try:
-                win32file.WriteFile(self.pipe, command.encode())
+                win32file.WriteFile(self.pipe, data)
             except pywintypes.error:
                 pass
         else:
-            self.pipe.write(command)
+            self.pipe.write(data)
+        self.writes += 1
+        self.bytes_written += len(data)
+
+    @property
+    def backlog(self):
+        """(int): With nonblocking, bytes still waiting for room in the pipe"""
+        return len(self._outbox)
+
+    def _send(self, command):
+        """Write without blocking. Whatever doesn't fit waits in the outbox, for next time"""
+        # Whether data starts part way through a command
+        starts_mid_command = False
+        if self._outbox:
+            # Dolphin hasn't taken the last of what we sent before. Rather than queue another frame
+            #   up behind it, finish any command that's half written, and then replace everything
+            #   else with one frame of the whole state
+            keep = 0
+            if self._mid_command:
+                keep = self._outbox.find(b"\n") + 1
+            self.frames_coalesced += self._outbox.count(b"FLUSH\n", keep)
+            data = self._outbox[:keep] + ("".join(self._sent.values()) + "FLUSH\n").encode()
+            starts_mid_command = keep > 0
+        else:
+            data = command.encode()
+        try:
+            written = self.pipe.write(data) or 0
+        except BlockingIOError as error:
+            written = error.characters_written
+        self.writes += 1
+        self.bytes_written += written
+        self._outbox = data[written:]
+        if not self._outbox:
+            self._mid_command = False
+            return
+        self.stalls += 1
+        if written > 0:
+            self._mid_command = data[written - 1] != ord("\n")
+        else:
+            self._mid_command = starts_mid_command
 
     def flush(self):
         """Actually send the button presses to the console
 
-        Up until this point, any buttons you 'press' are just queued in a pipe.
-        It doesn't get sent to the console until you flush
+        Up until this point, any buttons you 'press' are just queued up.
+        Only the inputs that changed since the last flush get sent, along with the
+        flush itself, all in one write to the pipe.
         """
-        # Move the current controller state into the previous one
-        self.prev = copy.copy(self.current)
+        # Copy the current controller state into the previous one. (Both keep their own
+        #   button dict, and nothing new gets allocated)
+        prev, current = self.prev, self.current
+        prev.button.update(current.button)
+        prev.main_stick = current.main_stick
+        prev.c_stick = current.c_stick
+        prev.l_shoulder = current.l_shoulder
+        prev.r_shoulder = current.r_shoulder
+        self.history.record(current)
 
         if self._is_dolphin:
-            self._write("FLUSH\n")
-            if platform.system() != "Windows":
-                if not self.pipe:
-                    return
-                self.pipe.flush()
+            if not self.pipe:
+                return
+            commands = []
+            sent = self._sent
+            for key, command in self._pending.items():
+                if sent.get(key) != command:
+                    sent[key] = command
+                    commands.append(command)
+            self._pending = {}
+            commands.append("FLUSH\n")
+            writes, written = self.writes, self.bytes_written
+            start = time.perf_counter_ns()
+            if self._nonblocking:
+                self._send("".join(commands))
+            else:
+                self._write("".join(commands))
+            self.write_latency.record(time.perf_counter_ns() - start)
+            self.flushes += 1
+            self.frame_writes = self.writes - writes
+            self.frame_bytes = self.bytes_written - written
@@ -0,0 +1,187 @@
+"""Batch processing of large collections of SLP files
+
+Replays are farmed out to a pool of worker processes, and only the results
+come back to the parent. (Not GameStates, which are big and slow to pickle)
+"""
+
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from melee import slp
+
+class ReplayFailure:
+    """A replay that couldn't be processed"""
+    __slots__ = ('path', 'error')
+    def __init__(self, path, error):
+        self.path = path
+        """(str): Path to the SLP file"""
+        self.error = error
+        """(str): Description of the exception the worker raised"""
+
+    def __str__(self):
+        return self.path + ": " + self.error
+
+class CorpusStats:
+    """Running totals for a pass over a corpus"""
+    def __init__(self):
+        self.total = 0
+        """(int): Number of files in the corpus"""
+        self.processed = 0
+        """(int): Number of files processed so far, including failures"""
+        self.bytes = 0
+        """(int): Size of all the files processed so far"""
+        self.failures = []
+        """(list of ReplayFailure): Files that raised an exception"""
+        self.start_time = time.time()
+        self.elapsed = 0
+        """(float): Seconds since processing started"""
+
+    @property
+    def files_per_second(self):
+        """(float): Throughput in replays per second"""
+        if self.elapsed <= 0:
+            return 0.
+        return self.processed / self.elapsed
+
+    @property
+    def megabytes_per_second(self):
+        """(float): Throughput in MB of SLP files per second"""
+        if self.elapsed <= 0:
+            return 0.
+        return self.bytes / self.elapsed / 1e6
+
+    def __str__(self):
+        return "%d/%d files, %d failed, %.1f files/s, %.1f MB/s" % \
+            (self.processed, self.total, len(self.failures), self.files_per_second, self.megabytes_per_second)
+
+def _describe(error):
+    """One line description of an exception"""
+    return "".join(traceback.format_exception_only(type(error), error)).strip()
+
+def _process_chunk(function, paths):
+    """Worker side: run the function over a chunk of files
+
+    Returns a list of (path, size, result, error) tuples. Exceptions are turned into strings
+    so that one bad replay doesn't take down the whole chunk.
+    """
+    results = []
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            results.append((path, size, function(path), None))
+        except Exception as error: # pylint: disable=broad-except
+            results.append((path, 0, None, _describe(error)))
+    return results
+
+class ReplayCorpus:
+    """A collection of SLP files to process in parallel
+
+    Example:
+        corpus = melee.ReplayCorpus("/replays/", function=count_shines, workers=8)
+        for path, result in corpus:
+            ...
+        print(corpus.stats)
+    """
+    def __init__(self, source, function=None, workers=None, chunksize=16, cache=None):
+        """Create a corpus
+
+        Args:
+            source (str or list of str): A directory (searched recursively for .slp files),
+                a glob pattern, or an explicit list of paths
+            function (callable): Called in a worker process as function(path) for each file. Its
+                return value is pickled back to the parent, so keep it small. Must be picklable
+                itself (IE: defined at the top level of a module). Defaults to slp.load_columns
+            workers (int): Number of worker processes. Defaults to the number of CPUs
+            chunksize (int): How many files to send to a worker at a time
+            cache (cache.ReplayCache): When using the default function, read and fill in
+                decoded columns from this cache
+        """
+        if isinstance(source, (list, tuple)):
+            paths = list(source)
+        elif os.path.isdir(source):
+            paths = sorted(glob.glob(os.path.join(source, "**", "*.slp"), recursive=True))
+        else:
+            paths = sorted(glob.glob(source, recursive=True))
+        self.paths = paths
+        """(list of str): Every SLP file in the corpus"""
+        if function is None:
+            function = cache.load_columns if cache is not None else slp.load_columns
+        self.function = function
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = max(1, chunksize)
+        self.stats = CorpusStats()
+        """(CorpusStats): Throughput and failures for the current (or last) pass"""
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return self.results()
+
+    def results(self):
+        """Process every file, yielding results as they come in
+
+        Results arrive in whatever order the workers finish them, not the order of paths.
+        Only a couple of chunks per worker are in flight at once, so memory stays bounded
+        no matter how big the corpus is.
+
+        Yields:
+            (str, object): The path of the file, and what the function returned for it.
+                Files that failed are skipped, and recorded in stats.failures instead.
+                That includes every file of a chunk whose results couldn't be sent back
+                (IE: they don't pickle), or whose worker died. The pool is restarted if it
+                has to be, and the rest of the corpus carries on.
+        """
+        self.stats = CorpusStats()
+        self.stats.total = len(self.paths)
+        chunks = (self.paths[i:i + self.chunksize] for i in range(0, len(self.paths), self.chunksize))
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        # Chunk of files each future is working on
+        pending = {}
+
+        def submit(chunk):
+            nonlocal executor
+            try:
+                future = executor.submit(_process_chunk, self.function, chunk)
+            except BrokenProcessPool:
+                # A worker died, which takes the whole pool with it. Start a new one
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=self.workers)
+                future = executor.submit(_process_chunk, self.function, chunk)
+            pending[future] = chunk
+
+        try:
+            for chunk in chunks:
+                submit(chunk)
+                if len(pending) >= self.workers * 2:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    # Keep the pool busy while we hand results back
+                    next_chunk = next(chunks, None)
+                    if next_chunk is not None:
+                        submit(next_chunk)
+                    try:
+                        results = future.result()
+                    except Exception as error: # pylint: disable=broad-except
+                        results = [(path, 0, None, _describe(error)) for path in chunk]
+                    for path, size, result, error in results:
+                        self.stats.processed += 1
+                        self.stats.bytes += size
+                        self.stats.elapsed = time.time() - self.stats.start_time
+                        if error is not None:
+                            self.stats.failures.append(ReplayFailure(path, error))
+                            continue
+                        yield path, result
+        finally:
+            # Don't start on chunks nobody is going to look at, if we were stopped early
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+        self.stats.elapsed = time.time() - self.stats.start_time
@@ -181,6 +181,28 @@ def to_internal(char_id):
         return Character.ROY
     return Character.UNKNOWN_CHARACTER
 
+# Character of each of Slippi's "external" character IDs, by ID. (The order used in replays' Game Start event)
+_EXTERNAL_CHARACTERS = (
+    Character.CPTFALCON, Character.DK, Character.FOX, Character.GAMEANDWATCH, Character.KIRBY,
+    Character.BOWSER, Character.LINK, Character.LUIGI, Character.MARIO, Character.MARTH,
+    Character.MEWTWO, Character.NESS, Character.PEACH, Character.PIKACHU, Character.POPO,
+    Character.JIGGLYPUFF, Character.SAMUS, Character.YOSHI, Character.ZELDA, Character.SHEIK,
+    Character.FALCO, Character.YLINK, Character.DOC, Character.ROY, Character.PICHU,
+    Character.GANONDORF, Character.UNKNOWN_CHARACTER, Character.WIREFRAME_MALE,
+    Character.WIREFRAME_FEMALE, Character.GIGA_BOWSER, Character.UNKNOWN_CHARACTER,
+    Character.SANDBAG, Character.POPO,
+)
+
+def from_external_id(char_id):
+    """Converts a Slippi 'external' character ID to an 'internal ID' enum
+
+    External IDs are what replays use in their Game Start event. (0 is Captain Falcon,
+    1 is DK, 2 is Fox, etc...) Not the same order as the character select screen.
+    """
+    if 0 <= char_id < len(_EXTERNAL_CHARACTERS):
+        return _EXTERNAL_CHARACTERS[char_id]
+    return Character.UNKNOWN_CHARACTER
+
 def from_internal(character):
     """Converts a character enum to an "external" ID.
 
@@ -0,0 +1,135 @@
+"""Where the time goes in each frame
+
+Console.step() times each stage of getting a frame to your bot, and records them
+into fixed-size histograms. So you can see where the 16.6ms frame budget goes,
+even over hours of play, without keeping every sample around.
+"""
+
+# Each power of two is split into this many buckets (so about 19% resolution)
+_SUB_BUCKETS = 4
+_SUB_BITS = 2
+# Enough buckets for anything up to 2**64 nanoseconds
+_BUCKETS = 65 * _SUB_BUCKETS
+
+def _bucket(nanoseconds):
+    """Which bucket a duration falls into"""
+    bits = nanoseconds.bit_length()
+    if bits <= _SUB_BITS + 1:
+        return nanoseconds
+    return bits * _SUB_BUCKETS + ((nanoseconds >> (bits - _SUB_BITS - 1)) & (_SUB_BUCKETS - 1))
+
+def _bucket_bounds(index):
+    """(int, int): The smallest and largest duration that land in a bucket"""
+    bits, sub = divmod(index, _SUB_BUCKETS)
+    if bits <= _SUB_BITS + 1:
+        return index, index
+    low = (_SUB_BUCKETS + sub) << (bits - _SUB_BITS - 1)
+    return low, low + (1 << (bits - _SUB_BITS - 1)) - 1
+
+class LatencyHistogram:
+    """A histogram of durations, with log-sized buckets
+
+    Memory use is fixed no matter how many samples are recorded. Percentiles are
+    accurate to within the width of a bucket, about 19%.
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        """(list of int): Number of samples in each bucket"""
+        self.count = 0
+        """(int): Number of samples recorded"""
+        self.total = 0
+        """(int): Sum of every sample, in nanoseconds"""
+        self.max = 0
+        """(int): Longest sample, in nanoseconds"""
+
+    def record(self, nanoseconds):
+        """Add one sample
+
+        Args:
+            nanoseconds (int): How long it took. (See time.perf_counter_ns())
+        """
+        if nanoseconds < 0:
+            nanoseconds = 0
+        self.counts[_bucket(nanoseconds)] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if nanoseconds > self.max:
+            self.max = nanoseconds
+
+    def percentile(self, percent):
+        """The duration that the given percent of samples are at or below
+
+        Args:
+            percent (float): Between 0 and 100
+
+        Returns:
+            float: Nanoseconds. (The middle of the bucket it falls in.) 0 if there are no samples
+        """
+        if self.count == 0:
+            return 0.
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                low, high = _bucket_bounds(index)
+                return min((low + high) / 2, self.max)
+        return float(self.max)
+
+    @property
+    def p50(self):
+        """(float): Median, in nanoseconds"""
+        return self.percentile(50)
+
+    @property
+    def p99(self):
+        """(float): 99th percentile, in nanoseconds"""
+        return self.percentile(99)
+
+    @property
+    def mean(self):
+        """(float): Average, in nanoseconds"""
+        if self.count == 0:
+            return 0.
+        return self.total / self.count
+
+    def reset(self):
+        """Throw away every sample"""
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def __str__(self):
+        return "p50 %.3fms  p99 %.3fms  max %.3fms  (%d samples)" % \
+            (self.p50 / 1e6, self.p99 / 1e6, self.max / 1e6, self.count)
+
+class FrameTimings:
+    """A LatencyHistogram for each stage of a frame
+
+    Stages:
+        network: Waiting on the console (or file) for messages
+        message_decode: Parsing messages (JSON and base64)
+        event_decode: Decoding the game events into the GameState
+        fixups: Fixing up derived fields (frame indexing, IASA)
+        flush: Flushing controller inputs
+        bot: Your own code, between one step() returning and the next being called
+        step: The whole of step(), start to finish
+    """
+    STAGES = ("network", "message_decode", "event_decode", "fixups", "flush", "bot", "step")
+
+    def __init__(self):
+        for stage in self.STAGES:
+            setattr(self, stage, LatencyHistogram())
+
+    def __getitem__(self, stage):
+        return getattr(self, stage)
+
+    def reset(self):
+        """Throw away every sample of every stage"""
+        for stage in self.STAGES:
+            self[stage].reset()
+
+    def __str__(self):
+        return "\n".join("%-14s %s" % (stage, self[stage]) for stage in self.STAGES)
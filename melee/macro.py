@@ -0,0 +1,248 @@
+"""Frame-perfect input sequences, worked out ahead of time
+
+A Macro is a sequence of controller inputs, one entry per frame: jump, wait out
+knee bend, shine. Each frame's inputs are turned into pipe commands as the macro is
+built, so playing one back is just a lookup per frame. A MacroRunner plays macros
+on any number of controllers at once, and cancels one if the character isn't in
+the state it expects: the wrong action or action frame, facing the wrong way, or out
+of position (you got hit, or the timing slipped).
+
+Example:
+    shine = melee.Macro("jump-cancel shine")
+    shine.then(melee.Button.BUTTON_Y)
+    shine.wait(2, expect=melee.Action.KNEE_BEND)
+    shine.then(melee.Button.BUTTON_B, main=(.5, 0), expect=melee.Action.KNEE_BEND)
+
+    runner = melee.MacroRunner()
+    while True:
+        gamestate = console.step()
+        if not runner.is_running(controller.port):
+            runner.start(shine, controller)
+        runner.step(gamestate)
+"""
+
+from melee import enums
+from melee.controller import ControllerState, state_commands, quantize_stick, quantize_shoulder
+
+def _as_set(value, kind):
+    """A single value, or a collection of them, as a frozenset. None stays None"""
+    if value is None:
+        return None
+    if isinstance(value, kind):
+        return frozenset((value,))
+    return frozenset(value)
+
+class _Expectation:
+    """What a player has to look like for a macro frame to go ahead"""
+    __slots__ = ('actions', 'action_frames', 'facing', 'on_ground', 'x', 'y')
+    def __init__(self, actions, action_frames, facing, on_ground, x, y):
+        self.actions = _as_set(actions, enums.Action)
+        self.action_frames = _as_set(action_frames, int)
+        self.facing = facing
+        self.on_ground = on_ground
+        self.x = x
+        self.y = y
+
+    def matches(self, player):
+        """Whether the player (gamestate.PlayerState) is as expected"""
+        if self.actions is not None and player.action not in self.actions:
+            return False
+        if self.action_frames is not None and player.action_frame not in self.action_frames:
+            return False
+        if self.facing is not None and bool(player.facing) != self.facing:
+            return False
+        if self.on_ground is not None and bool(player.on_ground) != self.on_ground:
+            return False
+        if self.x is not None and not self.x[0] <= player.x <= self.x[1]:
+            return False
+        if self.y is not None and not self.y[0] <= player.y <= self.y[1]:
+            return False
+        return True
+
+class _MacroFrame:
+    """One frame of a macro, ready to hand to a controller"""
+    __slots__ = ('state', 'commands', 'expect')
+    def __init__(self, buttons, main_stick, c_stick, l_shoulder, r_shoulder, expect):
+        state = ControllerState()
+        for item in buttons:
+            state.button[item] = True
+        state.main_stick = (quantize_stick(main_stick[0]), quantize_stick(main_stick[1]))
+        state.c_stick = (quantize_stick(c_stick[0]), quantize_stick(c_stick[1]))
+        state.l_shoulder = quantize_shoulder(l_shoulder)
+        state.r_shoulder = quantize_shoulder(r_shoulder)
+        self.state = state
+        self.commands = state_commands(state)
+        self.expect = expect
+
+class Macro:
+    """A sequence of inputs, one entry per frame
+
+    Build one up with then() and wait(). Each call adds frames to the end, and returns
+    the macro so calls can be chained. Every frame sets the whole controller: anything
+    not mentioned is released, or back at neutral.
+    """
+    def __init__(self, name="macro"):
+        """
+        Args:
+            name (str): What to call it, in logs
+        """
+        self.name = name
+        self._frames = []
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __repr__(self):
+        return "Macro(%r, %d frames)" % (self.name, len(self._frames))
+
+    def then(self, *buttons, main=(.5, .5), c=(.5, .5), l=0, r=0, frames=1, expect=None, action_frame=None,
+             facing=None, on_ground=None, x=None, y=None):
+        """Add frames that hold the given inputs
+
+        Args:
+            buttons (enums.Button): Buttons to hold
+            main (pair of floats): Main stick x, y. Ranges from 0 -> 1, 0.5 is neutral
+            c (pair of floats): C stick x, y
+            l (float): L shoulder analog press, 0 -> 1
+            r (float): R shoulder analog press, 0 -> 1
+            frames (int): How many frames to hold them for
+            expect (enums.Action or collection of them): The action the character has to be in
+                on each of these frames (just before the input goes in). Otherwise the macro is
+                cancelled. None to not check
+            action_frame (int or collection of them): The action_frame the character has to be on
+            facing (bool): Which way the character has to face. (True is right)
+            on_ground (bool): Whether the character has to be on the ground
+            x (pair of floats): Lowest and highest x position the character can be at
+            y (pair of floats): Lowest and highest y position the character can be at
+
+        Returns:
+            Macro: self
+
+        Note:
+            All the checks are against the frame that just came in, for the port the macro is
+            playing on. Any one of them not holding cancels the macro. Leave them all as None
+            to not check anything
+        """
+        expectation = None
+        if any(check is not None for check in (expect, action_frame, facing, on_ground, x, y)):
+            expectation = _Expectation(expect, action_frame, facing, on_ground, x, y)
+        frame = _MacroFrame(frozenset(buttons), main, c, l, r, expectation)
+        self._frames.extend([frame] * frames)
+        return self
+
+    def wait(self, frames=1, **checks):
+        """Add frames with nothing held
+
+        Args:
+            frames (int): How many frames
+            checks: What the character has to look like on each frame. Takes the same
+                expect, action_frame, facing, on_ground, x and y as then()
+
+        Returns:
+            Macro: self
+        """
+        return self.then(frames=frames, **checks)
+
+class _Playback:
+    """A macro part way through playing on one controller"""
+    __slots__ = ('macro', 'controller', 'frames', 'index', 'release_on_cancel')
+    def __init__(self, macro, controller, release_on_cancel):
+        self.macro = macro
+        self.controller = controller
+        self.frames = macro._frames
+        self.index = 0
+        self.release_on_cancel = release_on_cancel
+
+class MacroRunner:
+    """Plays macros on any number of controllers at once, one macro per port"""
+    DONE = "done"
+    """Status of a macro that played all the way through"""
+    CANCELLED = "cancelled"
+    """Status of a macro that was stopped part way"""
+
+    def __init__(self):
+        self._playing = {}
+        self.completed = 0
+        """(int): How many macros have played all the way through"""
+        self.cancelled = 0
+        """(int): How many macros were cancelled part way"""
+
+    def start(self, macro, controller, release_on_cancel=True):
+        """Start playing a macro, from the next step()
+
+        Anything already playing on the controller's port is cancelled.
+
+        Args:
+            macro (Macro): The macro
+            controller (controller.Controller): Controller to play it on
+            release_on_cancel (bool): Let go of everything if the macro gets cancelled
+        """
+        self.cancel(controller.port)
+        if len(macro) > 0:
+            self._playing[controller.port] = _Playback(macro, controller, release_on_cancel)
+
+    def cancel(self, port):
+        """Stop the macro playing on a port, if there is one
+
+        Args:
+            port (int): Controller port
+
+        Returns:
+            bool: Whether there was anything to cancel
+        """
+        playback = self._playing.pop(port, None)
+        if playback is None:
+            return False
+        self.cancelled += 1
+        if playback.release_on_cancel:
+            playback.controller.release_all()
+        return True
+
+    def is_running(self, port):
+        """Whether a macro is playing on a port
+
+        Args:
+            port (int): Controller port
+        """
+        return port in self._playing
+
+    def playing(self, port):
+        """The macro playing on a port
+
+        Args:
+            port (int): Controller port
+
+        Returns:
+            Macro: Or None if there isn't one
+        """
+        playback = self._playing.get(port)
+        return None if playback is None else playback.macro
+
+    def step(self, gamestate):
+        """Put in the next frame of every macro that's playing
+
+        Call once per frame, after console.step(). The inputs go out with the controllers' next flush.
+
+        Args:
+            gamestate (gamestate.GameState): The frame that just came in. Used to check each
+                macro's expectations (see Macro.then()), against the player on that controller's port
+
+        Returns:
+            dict: Status of each port whose macro ended this frame (DONE or CANCELLED)
+        """
+        ended = {}
+        for port, playback in list(self._playing.items()):
+            frame = playback.frames[playback.index]
+            if frame.expect is not None:
+                player = gamestate.player.get(port) if gamestate is not None else None
+                if player is None or not frame.expect.matches(player):
+                    self.cancel(port)
+                    ended[port] = self.CANCELLED
+                    continue
+            playback.controller.apply_state(frame.state, frame.commands)
+            playback.index += 1
+            if playback.index == len(playback.frames):
+                del self._playing[port]
+                self.completed += 1
+                ended[port] = self.DONE
+        return ended
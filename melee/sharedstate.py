@@ -0,0 +1,536 @@
+"""Share decoded frames with other processes on the same machine
+
+One process owns the connection to Dolphin, and publishes every GameState into a
+ring of fixed-layout slots in shared memory. Any number of other processes (a bot,
+a recorder, a stats overlay) can read them from there, without a connection of
+their own and without any locks.
+
+Example:
+    # In the process that owns the Console
+    publisher = melee.GameStatePublisher("melee-frames")
+    while True:
+        publisher.publish(console.step())
+
+    # In each reader process
+    reader = melee.GameStateReader("melee-frames")
+    while True:
+        gamestate = reader.next()
+        ...
+"""
+
+import struct
+import sys
+import time
+import zlib
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from melee import enums
+from melee.controller import ControllerState
+from melee.gamestate import GameState, PlayerState, Projectile
+
+# Buttons, in the order of their bits in the buttons field
+_BUTTONS = (enums.Button.BUTTON_A, enums.Button.BUTTON_B, enums.Button.BUTTON_X, enums.Button.BUTTON_Y,
+            enums.Button.BUTTON_Z, enums.Button.BUTTON_L, enums.Button.BUTTON_R, enums.Button.BUTTON_START,
+            enums.Button.BUTTON_D_UP, enums.Button.BUTTON_D_DOWN, enums.Button.BUTTON_D_LEFT,
+            enums.Button.BUTTON_D_RIGHT)
+_BUTTON_BITS = {button: 1 << bit for bit, button in enumerate(_BUTTONS)}
+
+PLAYER_DTYPE = np.dtype([
+    ("present", "?"),
+    ("character", "u1"),
+    ("character_selected", "u1"),
+    ("controller_status", "u1"),
+    ("action", "u2"),
+    ("prev_action", "u2"),
+    ("action_frame", "i4"),
+    ("x", "f4"),
+    ("y", "f4"),
+    ("percent", "i4"),
+    ("shield_strength", "f4"),
+    ("stock", "i4"),
+    ("facing", "?"),
+    ("on_ground", "?"),
+    ("off_stage", "?"),
+    ("hitlag", "?"),
+    ("invulnerable", "?"),
+    ("moonwalkwarning", "?"),
+    ("coin_down", "?"),
+    ("is_holding_cpu_slider", "?"),
+    ("invulnerability_left", "i4"),
+    ("hitstun_frames_left", "i4"),
+    ("jumps_left", "i4"),
+    ("iasa", "i4"),
+    ("speed_air_x_self", "f4"),
+    ("speed_y_self", "f4"),
+    ("speed_x_attack", "f4"),
+    ("speed_y_attack", "f4"),
+    ("speed_ground_x_self", "f4"),
+    ("ecb_top", "f4", (2,)),
+    ("ecb_bottom", "f4", (2,)),
+    ("ecb_left", "f4", (2,)),
+    ("ecb_right", "f4", (2,)),
+    ("cursor_x", "f4"),
+    ("cursor_y", "f4"),
+    ("costume", "u1"),
+    ("cpu_level", "i4"),
+    ("main_stick", "f4", (2,)),
+    ("c_stick", "f4", (2,)),
+    ("l_shoulder", "f4"),
+    ("r_shoulder", "f4"),
+    ("buttons", "u2"),
+])
+"""(numpy.dtype): Layout of one player, within a frame"""
+
+PROJECTILE_DTYPE = np.dtype([
+    ("x", "f4"),
+    ("y", "f4"),
+    ("x_speed", "f4"),
+    ("y_speed", "f4"),
+    ("owner", "i1"),
+    ("subtype", "u2"),
+])
+"""(numpy.dtype): Layout of one projectile, within a frame"""
+
+def frame_dtype(max_projectiles):
+    """Layout of one whole frame
+
+    Args:
+        max_projectiles (int): Room for this many projectiles. Any more are left out
+
+    Returns:
+        numpy.dtype
+    """
+    return np.dtype([
+        ("frame", "i4"),
+        ("stage", "u1"),
+        ("menu_state", "u1"),
+        ("submenu", "u1"),
+        ("ready_to_start", "?"),
+        ("menu_selection", "i4"),
+        ("distance", "f4"),
+        ("stage_select_cursor_x", "f4"),
+        ("stage_select_cursor_y", "f4"),
+        ("player", PLAYER_DTYPE, (4,)),
+        ("projectile_count", "u2"),
+        ("projectiles", PROJECTILE_DTYPE, (max_projectiles,)),
+    ])
+
+_MAGIC = 0x534c4d47
+_HEADER_DTYPE = np.dtype([
+    ("magic", "u4"),
+    ("layout", "u4"),
+    ("slots", "u4"),
+    ("max_projectiles", "u4"),
+    # Sequence number of the newest complete frame. -1 before the first one
+    ("latest", "i8"),
+])
+_HEADER_SIZE = 64
+_LATEST_OFFSET = _HEADER_DTYPE.fields["latest"][1]
+_LATEST = struct.Struct("<q")
+_LOCK = struct.Struct("<Q")
+
+def _layout_id(dtype):
+    """A checksum of a frame layout, so readers can tell they agree with the publisher"""
+    return zlib.crc32(repr(dtype.descr).encode())
+
+# struct codes for each numpy type we use, by kind and size
+_STRUCT_CODES = {"b1": "?", "u1": "B", "i1": "b", "u2": "H", "i4": "i", "u4": "I", "i8": "q", "f4": "f"}
+
+def _struct_format(dtype):
+    """A struct format that packs values into the same bytes as the given (flat) numpy layout"""
+    parts = []
+    position = 0
+    for name in dtype.names:
+        field, offset = dtype.fields[name][:2]
+        if offset > position:
+            parts.append("%dx" % (offset - position))
+        base, count = field, 1
+        if field.subdtype is not None:
+            base, shape = field.subdtype
+            count = int(np.prod(shape))
+        if base.names is not None:
+            parts.extend([_struct_format(base)] * count)
+        else:
+            parts.append("%d%s" % (count, _STRUCT_CODES[base.kind + str(base.itemsize)]))
+        position = offset + field.itemsize
+    if dtype.itemsize > position:
+        parts.append("%dx" % (dtype.itemsize - position))
+    return "".join(parts)
+
+def _regions(buf, slots, max_projectiles):
+    """Carve a shared memory buffer up into (header, locks, slots) arrays"""
+    dtype = frame_dtype(max_projectiles)
+    header = np.ndarray((1,), _HEADER_DTYPE, buf, 0)
+    locks = np.ndarray((slots,), np.uint64, buf, _HEADER_SIZE)
+    frames = np.ndarray((slots,), dtype, buf, _HEADER_SIZE + 8 * slots)
+    return header, locks, frames
+
+class GameStatePublisher:
+    """Writes GameStates into a ring of frames in shared memory
+
+    Each slot of the ring has a sequence lock next to it: it's odd while the slot is being
+    written, and 2 * (sequence number + 1) once the frame in it is complete. Readers check
+    it before and after they look at a slot, so they never need to take a lock.
+    """
+    def __init__(self, name=None, slots=64, max_projectiles=32):
+        """Create the shared memory
+
+        Args:
+            name (str): Name of the shared memory block, for readers to find it by. None
+                picks a unique one (see the name attribute)
+            slots (int): How many frames the ring holds. A reader that falls further behind
+                than this misses frames
+            max_projectiles (int): Room for this many projectiles per frame
+        """
+        self.slots = slots
+        self.max_projectiles = max_projectiles
+        dtype = frame_dtype(max_projectiles)
+        size = _HEADER_SIZE + 8 * slots + dtype.itemsize * slots
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self._shm.name
+        """(str): Name of the shared memory block"""
+        self._header, self._locks, self._frames = _regions(self._shm.buf, slots, max_projectiles)
+        self._locks[:] = 0
+        self._header["magic"] = _MAGIC
+        self._header["layout"] = _layout_id(dtype)
+        self._header["slots"] = slots
+        self._header["max_projectiles"] = max_projectiles
+        self._header["latest"] = -1
+        self._seq = 0
+        # Frames get packed straight into the ring with struct, which is much faster than numpy
+        self._packer = struct.Struct("<" + _struct_format(dtype))
+        self._offset = _HEADER_SIZE + 8 * slots
+        self._absent_player = [0] * len(struct.Struct("<" + _struct_format(PLAYER_DTYPE)).unpack(bytes(PLAYER_DTYPE.itemsize)))
+        self._absent_projectile = [0] * 6
+        self._buf = self._shm.buf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def _player_values(playerstate):
+        """Every field of a player, flattened out in the order of PLAYER_DTYPE"""
+        controller = playerstate.controller_state
+        buttons = 0
+        for button, pressed in controller.button.items():
+            if pressed:
+                buttons |= _BUTTON_BITS.get(button, 0)
+        return (True, playerstate.character.value, playerstate.character_selected.value,
+                playerstate.controller_status.value, playerstate.action.value, playerstate.prev_action.value,
+                playerstate.action_frame, playerstate.x, playerstate.y, playerstate.percent,
+                playerstate.shield_strength, playerstate.stock, playerstate.facing, playerstate.on_ground,
+                playerstate.off_stage, playerstate.hitlag, playerstate.invulnerable, playerstate.moonwalkwarning,
+                playerstate.coin_down, playerstate.is_holding_cpu_slider, playerstate.invulnerability_left,
+                playerstate.hitstun_frames_left, playerstate.jumps_left, playerstate.iasa,
+                playerstate.speed_air_x_self, playerstate.speed_y_self, playerstate.speed_x_attack,
+                playerstate.speed_y_attack, playerstate.speed_ground_x_self) + \
+                tuple(playerstate.ecb_top) + tuple(playerstate.ecb_bottom) + tuple(playerstate.ecb_left) + \
+                tuple(playerstate.ecb_right) + \
+               (playerstate.cursor_x, playerstate.cursor_y, playerstate.costume, playerstate.cpu_level) + \
+                tuple(controller.main_stick) + tuple(controller.c_stick) + \
+               (controller.l_shoulder, controller.r_shoulder, buttons)
+
+    def publish(self, gamestate):
+        """Write a frame into the ring
+
+        Args:
+            gamestate (gamestate.GameState): The frame. Nothing happens if it's None
+
+        Returns:
+            int: Sequence number of the frame. (They start at 0, and count up by one)
+        """
+        if gamestate is None:
+            return None
+        values = [gamestate.frame, gamestate.stage.value, gamestate.menu_state.value, gamestate.submenu.value,
+                  gamestate.ready_to_start, gamestate.menu_selection, gamestate.distance,
+                  gamestate.stage_select_cursor_x, gamestate.stage_select_cursor_y]
+        for port in range(1, 5):
+            if port in gamestate.player:
+                values.extend(self._player_values(gamestate.player[port]))
+            else:
+                values.extend(self._absent_player)
+        projectiles = gamestate.projectiles[:self.max_projectiles]
+        values.append(len(projectiles))
+        for projectile in projectiles:
+            values.extend((projectile.x, projectile.y, projectile.x_speed, projectile.y_speed, projectile.owner,
+                           projectile.subtype.value))
+        values.extend(self._absent_projectile * (self.max_projectiles - len(projectiles)))
+
+        seq = self._seq
+        index = seq % self.slots
+        lock = _HEADER_SIZE + 8 * index
+        _LOCK.pack_into(self._buf, lock, 2 * seq + 1)
+        self._packer.pack_into(self._buf, self._offset + index * self._packer.size, *values)
+        _LOCK.pack_into(self._buf, lock, 2 * seq + 2)
+        _LATEST.pack_into(self._buf, _LATEST_OFFSET, seq)
+        self._seq += 1
+        return seq
+
+    def close(self, unlink=True):
+        """Stop publishing
+
+        Args:
+            unlink (bool): Also remove the shared memory, once every reader has closed it
+        """
+        self._header = self._locks = self._frames = self._buf = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Someone still holds a view into the ring. The mapping goes away once they let go
+            pass
+        if unlink:
+            # A reader in a process sharing our resource tracker may have unregistered the name.
+            #   Make sure it's there, or the tracker complains when we unlink it
+            resource_tracker.register(self._shm._name, "shared_memory") # pylint: disable=protected-access
+            self._shm.unlink()
+
+def _convert(name, convert):
+    """Property that reads a field straight out of shared memory"""
+    def getter(self):
+        return convert(self._record[name])
+    getter.__name__ = name
+    return property(getter)
+
+def _pair(value):
+    return (float(value[0]), float(value[1]))
+
+class SharedPlayerState:
+    """Read-only view of a player, straight out of shared memory
+
+    Has the same attributes as gamestate.PlayerState.
+    """
+    __slots__ = ('_record',)
+    def __init__(self, record):
+        self._record = record
+
+    @property
+    def controller_state(self):
+        """(controller.ControllerState): Copy of the player's controller state"""
+        state = ControllerState()
+        buttons = int(self._record["buttons"])
+        for bit, button in enumerate(_BUTTONS):
+            state.button[button] = bool(buttons & (1 << bit))
+        state.main_stick = _pair(self._record["main_stick"])
+        state.c_stick = _pair(self._record["c_stick"])
+        state.l_shoulder = float(self._record["l_shoulder"])
+        state.r_shoulder = float(self._record["r_shoulder"])
+        return state
+
+    def copy(self):
+        """Copy out into a regular PlayerState
+
+        Returns:
+            gamestate.PlayerState
+        """
+        playerstate = PlayerState()
+        for name in _PLAYER_ATTRIBUTES:
+            setattr(playerstate, name, getattr(self, name))
+        playerstate.controller_state = self.controller_state
+        return playerstate
+
+_PLAYER_CONVERSIONS = {
+    "character": enums.Character,
+    "character_selected": enums.Character,
+    "controller_status": enums.ControllerStatus,
+    "action": enums.Action,
+    "prev_action": enums.Action,
+    "x": float, "y": float, "shield_strength": float,
+    "speed_air_x_self": float, "speed_y_self": float, "speed_x_attack": float,
+    "speed_y_attack": float, "speed_ground_x_self": float,
+    "cursor_x": float, "cursor_y": float,
+    "ecb_top": _pair, "ecb_bottom": _pair, "ecb_left": _pair, "ecb_right": _pair,
+    "facing": bool, "on_ground": bool, "off_stage": bool, "hitlag": bool, "invulnerable": bool,
+    "moonwalkwarning": bool, "coin_down": bool, "is_holding_cpu_slider": bool,
+}
+_PLAYER_ATTRIBUTES = [name for name in PLAYER_DTYPE.names if name not in
+                      ("present", "main_stick", "c_stick", "l_shoulder", "r_shoulder", "buttons")]
+for _name in _PLAYER_ATTRIBUTES:
+    setattr(SharedPlayerState, _name, _convert(_name, _PLAYER_CONVERSIONS.get(_name, int)))
+
+class SharedProjectile:
+    """Read-only view of a projectile, straight out of shared memory
+
+    Has the same attributes as gamestate.Projectile.
+    """
+    __slots__ = ('_record',)
+    def __init__(self, record):
+        self._record = record
+
+    x = _convert("x", float)
+    y = _convert("y", float)
+    x_speed = _convert("x_speed", float)
+    y_speed = _convert("y_speed", float)
+    owner = _convert("owner", int)
+    subtype = _convert("subtype", enums.ProjectileSubtype)
+
+class SharedGameState:
+    """Read-only view of a frame, straight out of shared memory
+
+    Has the same attributes as gamestate.GameState. Nothing is copied: every attribute is
+    read out of the ring when you access it. So if the publisher laps you, what you read
+    can change underneath you. Check valid once you're done reading, or copy() the frame
+    out if you want to hold on to it.
+    """
+    __slots__ = ('_record', '_locks', '_index', '_lock', 'seq', 'player', 'projectiles')
+    def __init__(self, record, locks, index, seq):
+        self._record = record
+        self._locks = locks
+        self._index = index
+        self._lock = 2 * seq + 2
+        self.seq = seq
+        """(int): Sequence number of the frame"""
+        players = record["player"]
+        self.player = {port: SharedPlayerState(players[port - 1]) for port in range(1, 5) if players[port - 1]["present"]}
+        """(dict of int: SharedPlayerState): Players in the frame, by port"""
+        count = int(record["projectile_count"])
+        projectiles = record["projectiles"]
+        self.projectiles = [SharedProjectile(projectiles[i]) for i in range(count)]
+        """(list of SharedProjectile): Projectiles in the frame"""
+
+    @property
+    def valid(self):
+        """(bool): Whether the slot still holds this frame. (IE: the publisher hasn't lapped us)"""
+        return int(self._locks[self._index]) == self._lock
+
+    frame = _convert("frame", int)
+    stage = _convert("stage", enums.Stage)
+    menu_state = _convert("menu_state", enums.Menu)
+    submenu = _convert("submenu", enums.SubMenu)
+    ready_to_start = _convert("ready_to_start", bool)
+    menu_selection = _convert("menu_selection", int)
+    distance = _convert("distance", float)
+    stage_select_cursor_x = _convert("stage_select_cursor_x", float)
+    stage_select_cursor_y = _convert("stage_select_cursor_y", float)
+
+    def copy(self):
+        """Copy out into a regular GameState
+
+        Returns:
+            gamestate.GameState: Or None if the publisher overwrote the frame while we were copying it
+        """
+        gamestate = GameState()
+        for name in ("frame", "stage", "menu_state", "submenu", "ready_to_start", "menu_selection", "distance",
+                     "stage_select_cursor_x", "stage_select_cursor_y"):
+            setattr(gamestate, name, getattr(self, name))
+        gamestate.player = {port: player.copy() for port, player in self.player.items()}
+        for shared in self.projectiles:
+            projectile = Projectile()
+            projectile.x, projectile.y = shared.x, shared.y
+            projectile.x_speed, projectile.y_speed = shared.x_speed, shared.y_speed
+            projectile.owner, projectile.subtype = shared.owner, shared.subtype
+            gamestate.projectiles.append(projectile)
+        if not self.valid:
+            return None
+        return gamestate
+
+class GameStateReader:
+    """Reads the frames a GameStatePublisher writes, from another process"""
+    def __init__(self, name):
+        """Attach to a publisher's shared memory
+
+        Args:
+            name (str): Name of the shared memory block. (The publisher's name attribute)
+
+        Raises:
+            ValueError: If the shared memory wasn't made by a compatible GameStatePublisher
+        """
+        # Python would otherwise remove the shared memory when this process exits, out from
+        #   under the publisher and every other reader
+        if sys.version_info >= (3, 13):
+            self._shm = shared_memory.SharedMemory(name=name, track=False) # pylint: disable=unexpected-keyword-arg
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self._shm._name, "shared_memory") # pylint: disable=protected-access
+        header = np.ndarray((1,), _HEADER_DTYPE, self._shm.buf, 0)
+        if int(header["magic"][0]) != _MAGIC:
+            self._shm.close()
+            raise ValueError(name + " isn't a GameStatePublisher's shared memory")
+        self.slots = int(header["slots"][0])
+        max_projectiles = int(header["max_projectiles"][0])
+        if int(header["layout"][0]) != _layout_id(frame_dtype(max_projectiles)):
+            self._shm.close()
+            raise ValueError(name + " was written by an incompatible version of libmelee")
+        self._header, self._locks, self._frames = _regions(self._shm.buf, self.slots, max_projectiles)
+        self._next = None
+        self.frames_missed = 0
+        """(int): Frames that the publisher overwrote before next() got to them"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _view(self, seq):
+        """A view of the given frame. None if it isn't (or is no longer) in the ring"""
+        index = seq % self.slots
+        if int(self._locks[index]) != 2 * seq + 2:
+            return None
+        return SharedGameState(self._frames[index], self._locks, index, seq)
+
+    @property
+    def latest_seq(self):
+        """(int): Sequence number of the newest frame published. -1 if there isn't one yet"""
+        return int(self._header["latest"][0])
+
+    def latest(self):
+        """The newest frame
+
+        Returns:
+            SharedGameState: Or None if nothing's been published yet
+        """
+        while True:
+            seq = self.latest_seq
+            if seq < 0:
+                return None
+            view = self._view(seq)
+            if view is not None:
+                return view
+
+    def next(self, timeout=None, poll_interval=0.0005):
+        """The next frame after the last one this returned, waiting for it if need be
+
+        The first call starts from the newest frame. After that, frames come back in order.
+        If the publisher gets a whole ring ahead of us, we skip ahead, and count the frames
+        we missed in frames_missed.
+
+        Args:
+            timeout (float): Give up after this many seconds. None to wait forever
+            poll_interval (float): How long to sleep between checks for a new frame
+
+        Returns:
+            SharedGameState: Or None if the timeout ran out
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            latest = self.latest_seq
+            if self._next is None and latest >= 0:
+                self._next = latest
+            if self._next is not None and latest >= self._next:
+                # Leave a slot of room, since the publisher may be partway through the oldest one
+                oldest = latest - self.slots + 2
+                if self._next < oldest:
+                    self.frames_missed += oldest - self._next
+                    self._next = oldest
+                view = self._view(self._next)
+                if view is not None:
+                    self._next += 1
+                    return view
+                continue
+            if deadline is not None and time.time() > deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def close(self):
+        """Detach from the shared memory"""
+        self._header = self._locks = self._frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Someone still holds a view into the ring. The mapping goes away once they let go
+            pass
@@ -5,7 +5,13 @@ This can be used to talk to some server implementing the Slippstream protocol
 (i.e. the Project Slippi fork of Nintendont or Slippi Ishiiruka).
 """
 
+import asyncio
+import binascii
+import re
+import select
 import socket
+import threading
+import time
 from enum import Enum
 import enet
 import json
@@ -30,17 +36,96 @@ class CommType(Enum):
     KEEPALIVE = 0x03
     MENU = 0x04
 
+_PAYLOADS = EventType.PAYLOADS.value
+_GAME_END = EventType.GAME_END.value
+
+def _event_sizes(payload):
+    """Size of each event, by command byte, from the Event Payloads event at the start of a game"""
+    sizes = {_PAYLOADS: payload[1]}
+    for index in range(2, min(len(payload), payload[1] + 1), 3):
+        sizes[payload[index]] = (payload[index + 1] << 8) | payload[index + 2]
+    return sizes
+
+# The server hanging up this soon (in seconds) after a game ends is the end of the stream,
+#   rather than a dropped connection
+_GAME_END_GRACE = 2.0
+
+_PAYLOAD_START = re.compile(rb'"payload"\s*:\s*"')
+_JSON = json.JSONDecoder()
+
+def parse_message(data):
+    """Parse one SlippiComm message
+
+    game_event and menu_event messages carry a (large) base64 payload. For those, the payload
+    is found in place and base64 decoded straight out of the packet. Only the few small fields
+    around it go through the JSON parser. Everything else gets a regular JSON parse.
+
+    Args:
+        data (bytes): The raw packet
+
+    Returns:
+        dict: The message. For game and menu events, "payload" is already decoded to bytes.
+            None for anything that can't be parsed
+    """
+    match = _PAYLOAD_START.search(data)
+    if match is not None:
+        start = match.end()
+        end = data.find(b'"', start)
+        # Escaped characters mean it isn't plain base64. Let the JSON parser sort it out
+        if end != -1 and data.find(b'\\', start, end) == -1:
+            try:
+                message = _JSON.raw_decode((data[:start] + data[end:]).decode())[0]
+            except (UnicodeDecodeError, ValueError):
+                message = None
+            if isinstance(message, dict) and message.get("type") in ("game_event", "menu_event"):
+                message["payload"] = binascii.a2b_base64(memoryview(data)[start:end])
+                return message
+    try:
+        return json.loads(data)
+    except json.JSONDecodeError:
+        return None
+
 class SlippstreamClient():
     """ Container representing a client to some SlippiComm server """
 
-    def __init__(self, address="127.0.0.1", port=51441, realtime=True):
-        """ Constructor for this object """
-        self._host = enet.Host(None, 1, 0, 0)
+    def __init__(self, address="127.0.0.1", port=51441, realtime=True, reconnect_timeout=None, max_backoff=1.0,
+                 host=None):
+        """ Constructor for this object
+
+        Args:
+            reconnect_timeout (float): If the connection drops, keep trying to reconnect for
+                this many seconds. The stream picks up from where it left off. None to give
+                up right away
+            max_backoff (float): Longest wait between reconnect attempts, in seconds
+            host (enet.Host): Connect through this host, shared with other clients. None for
+                one of our own
+        """
+        self._host = enet.Host(None, 1, 0, 0) if host is None else host
         self._peer = None
         self.buf = bytearray()
         self.realtime = realtime
         self.address = address
         self.port = port
+        self.disconnected = False
+        """(bool): Whether the server has closed the connection"""
+        self.decode_time = 0
+        """(int): Running total of nanoseconds spent parsing messages"""
+        self.cursor = 0
+        """(int): Position in the stream, just past the last message received. We ask to
+            pick up from here when reconnecting"""
+        self.reconnect_timeout = reconnect_timeout
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+        """(int): How many times the stream has picked back up, after the connection dropped"""
+        self.game_ended = False
+        """(bool): Whether the last thing in the stream was the end of a game. The server hanging
+            up right after that is just the end of the stream, not something to reconnect for.
+            Cleared by whatever comes next, like the menu events between games"""
+        self._game_ended_at = None
+        self._event_sizes = None
+        self._lost_at = None
+        self._retry_at = None
+        self._backoff = 0
 
     def shutdown(self):
         """ Close down the socket and connection to the console """
@@ -56,42 +141,222 @@ class SlippstreamClient():
 
     def dispatch(self, polling_mode):
         """Dispatch messages with the peer (read and write packets)"""
-        event = None
-        event_type = 1000
-        while event_type not in [enet.EVENT_TYPE_RECEIVE]:
-            wait_time = 1000
-            if polling_mode:
-                wait_time = 0
-            event = self._host.service(wait_time)
-            event_type = event.type
-
-            if event.type == enet.EVENT_TYPE_NONE:
-                if polling_mode:
-                    return None
-            if event.type == enet.EVENT_TYPE_RECEIVE:
-                try:
-                    return json.loads(event.packet.data)
-                except json.JSONDecodeError:
-                    # This happens at the end of a game for some reason?
-                    if len(event.packet.data) == 0:
-                        event_type = 0
-                        continue
-                    return None
-            elif event.type == enet.EVENT_TYPE_CONNECT:
-                handshake = json.dumps({
-                    "type" : "connect_request",
-                    "cursor" : 0,
-                })
-                self._peer.send(0, enet.Packet(handshake.encode()))
-            elif event.type == enet.EVENT_TYPE_DISCONNECT:
+        wait_time = 1000
+        if polling_mode:
+            wait_time = 0
+        while True:
+            message = self.receive(wait_time)
+            if message is not None:
+                return message
+            if polling_mode or self.disconnected:
                 return None
+
+    def receive(self, wait_time):
+        """Service the connection for up to wait_time ms, and return a message if one came in
+
+        Unlike dispatch(), this always gives up after wait_time. So it's handy for a
+        loop that also needs to check on other things now and then.
+
+        Returns:
+            dict: The message. None if there wasn't one yet (or the connection dropped.
+                See disconnected)
+        """
+        if self._retry_at is not None:
+            now = time.monotonic()
+            if now >= self._retry_at:
+                self._retry_at = None
+                self._connect_peer()
+            else:
+                wait_time = min(wait_time, int((self._retry_at - now) * 1000) + 1)
+        event = self._host.service(0)
+        if event.type == enet.EVENT_TYPE_NONE and wait_time > 0:
+            # pyenet holds on to the GIL while it waits inside service(), which would stall every
+            #   other thread. So do the waiting in select() instead, and only service what's there
+            select.select([self._host.socket.fileno()], [], [], wait_time / 1000)
+            event = self._host.service(0)
+        if event.type == enet.EVENT_TYPE_RECEIVE:
+            # Empty packets show up at the end of a game for some reason
+            if len(event.packet.data) == 0:
+                return None
+            start = time.perf_counter_ns()
+            message = parse_message(event.packet.data)
+            self.decode_time += time.perf_counter_ns() - start
+            if message is not None:
+                self._received(message)
+            return message
+        elif event.type == enet.EVENT_TYPE_CONNECT:
+            self._send_handshake()
+        elif event.type == enet.EVENT_TYPE_DISCONNECT:
+            self._disconnected()
         return None
 
+    def _received(self, message):
+        """Keep track of where we are in the stream, given a message that just came in"""
+        if "next_cursor" in message:
+            self.cursor = message["next_cursor"]
+            # Only count the connection as back once the stream is moving again
+            if self._lost_at is not None:
+                self.reconnects += 1
+                self._lost_at = None
+        if message.get("type") == "game_event":
+            self._watch_for_game_end(message["payload"])
+        else:
+            # The stream carried on past the end of the game
+            self.game_ended = False
+
+    def _disconnected(self):
+        """The server hung up (or stopped answering)"""
+        self._peer = None
+        if self.game_ended and time.monotonic() - self._game_ended_at < _GAME_END_GRACE:
+            # The server hangs up once the game is over. That's the end of the stream
+            self._retry_at = None
+            self.disconnected = True
+        else:
+            self._connection_lost()
+
+    def _watch_for_game_end(self, payload):
+        """Keep track of whether the game in the stream has ended"""
+        if not isinstance(payload, (bytes, bytearray)) or len(payload) < 2:
+            return
+        if payload[0] == _PAYLOADS:
+            # A new game
+            self._event_sizes = _event_sizes(payload)
+        size = self._event_sizes.get(_GAME_END) if self._event_sizes is not None else None
+        # A game end can only be the last thing in the payload. If this check ever hits by chance
+        #   instead, the next frame clears it again
+        self.game_ended = size is not None and len(payload) > size and payload[-size - 1] == _GAME_END
+        if self.game_ended:
+            self._game_ended_at = time.monotonic()
+
+    def _connection_lost(self):
+        """Schedule another try at connecting, with exponential backoff. Or give up"""
+        now = time.monotonic()
+        if self._lost_at is None:
+            self._lost_at = now
+            self._backoff = 0.05
+        if self.reconnect_timeout is None or now - self._lost_at > self.reconnect_timeout:
+            self._retry_at = None
+            self.disconnected = True
+            return
+        self._retry_at = now + self._backoff
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def _send_handshake(self):
+        """Ask the server to start sending us game events"""
+        handshake = json.dumps({
+            "type" : "connect_request",
+            "cursor" : self.cursor,
+        })
+        self._peer.send(0, enet.Packet(handshake.encode()))
+
     def connect(self):
         """ Connect to the server
 
         Returns True on success, False on failure
         """
         # Try to connect to the server and send a handshake
+        self._connect_peer()
+        return True
+
+    def _connect_peer(self):
+        """Start connecting. The handshake goes out once the connection is up"""
         self._peer = self._host.connect(enet.Address(bytes(self.address, 'utf-8'), int(self.port)), 1)
+
+class AsyncSlippstreamClient(SlippstreamClient):
+    """ A SlippiComm client for use with asyncio
+
+    The enet connection is serviced on its own I/O thread, which hands messages over
+    to the event loop through an asyncio queue. So waiting on the console never blocks
+    the loop, and one loop can drive several consoles (or anything else) at once.
+
+    Only the I/O thread ever touches the enet host.
+    """
+
+    def __init__(self, address="127.0.0.1", port=51441, realtime=True, reconnect_timeout=None, max_backoff=1.0,
+                 service_interval=10):
+        """ Constructor for this object
+
+        Args:
+            reconnect_timeout (float): See SlippstreamClient
+            max_backoff (float): See SlippstreamClient
+            service_interval (int): How long (in ms) the I/O thread waits on the socket at a
+                time. This only bounds how quickly shutdown() is noticed. Packets are picked
+                up as soon as they arrive regardless.
+        """
+        super().__init__(address, port, realtime, reconnect_timeout, max_backoff)
+        self.service_interval = service_interval
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._closed = False
+
+    async def connect(self):
+        """ Connect to the server, and start servicing the connection
+
+        Must be awaited from the event loop that dispatch() will be called from.
+
+        Returns True on success, False on failure
+        """
+        if self._thread is not None:
+            return True
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._stopping.clear()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="slippstream-io", daemon=True)
+        self._thread.start()
         return True
+
+    def _run(self):
+        """Body of the I/O thread"""
+        self._connect_peer()
+        try:
+            while not self._stopping.is_set() and not self.disconnected:
+                message = self.receive(self.service_interval)
+                if message is not None:
+                    self._deliver(message)
+        finally:
+            SlippstreamClient.shutdown(self)
+            self._deliver(None)
+
+    def _deliver(self, message):
+        """Hand a message (or None, for a disconnect) over to the event loop"""
+        try:
+            self._loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The event loop has been closed out from under us
+            self._stopping.set()
+
+    def _put(self, message):
+        if message is None:
+            self._closed = True
+        self._queue.put_nowait(message)
+
+    async def dispatch(self, polling_mode):
+        """Wait for the next message from the server
+
+        Cancelling this (or timing it out with asyncio.wait_for) is safe. No messages are lost.
+
+        Returns:
+            dict: The message. Or None if the connection is gone, or in polling mode
+                if there's nothing new yet.
+        """
+        if self._queue is None:
+            return None
+        if self._closed and self._queue.empty():
+            return None
+        if polling_mode:
+            try:
+                return self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+        return await self._queue.get()
+
+    def shutdown(self):
+        """ Close down the connection to the console, and stop the I/O thread """
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        return False
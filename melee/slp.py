@@ -0,0 +1,659 @@
+"""Binary layouts of Slippi replay events
+
+Each event type is described once here as a table of fields. Those tables are
+compiled into struct decoders that match the payload sizes a particular
+stream or SLP file reports, so that whole events can be unpacked in one call.
+"""
+
+import contextlib
+import hashlib
+import mmap
+import os
+import struct
+
+import numpy as np
+from numpy.lib import recfunctions
+import ubjson
+
+from melee import enums
+from melee.slippstream import EventType
+from melee.version import __version__
+
+# Fields of each event we care about, sorted by offset
+#   (name, offset from the command byte, struct format, default when the event is too old to have it)
+PRE_FRAME_FIELDS = (
+    ("frame", 0x1, "i", 0),
+    ("port", 0x5, "B", 0),
+    ("is_follower", 0x6, "B", 0),
+    ("main_x", 0x19, "f", 0),
+    ("main_y", 0x1D, "f", 0),
+    ("c_x", 0x21, "f", 0),
+    ("c_y", 0x25, "f", 0),
+    ("buttons", 0x31, "H", 0),
+)
+
+POST_FRAME_FIELDS = (
+    ("frame", 0x1, "i", 0),
+    ("port", 0x5, "B", 0),
+    ("is_follower", 0x6, "B", 0),
+    ("character", 0x7, "B", 0),
+    ("action", 0x8, "H", 0),
+    ("x", 0xA, "f", 0),
+    ("y", 0xE, "f", 0),
+    ("facing", 0x12, "f", 0),
+    ("percent", 0x16, "f", 0),
+    ("shield_strength", 0x1A, "f", 0),
+    ("stock", 0x21, "B", 0),
+    ("action_frame", 0x22, "f", 0),
+    ("state_flags_2", 0x27, "B", 0),
+    ("hitstun_frames_left", 0x2B, "f", 0),
+    ("airborne", 0x2F, "B", 0),
+    ("jumps_left", 0x32, "B", 1),
+    ("hurtbox_status", 0x34, "B", 0),
+    ("speed_air_x_self", 0x35, "f", 0),
+    ("speed_y_self", 0x39, "f", 0),
+    ("speed_x_attack", 0x3D, "f", 0),
+    ("speed_y_attack", 0x41, "f", 0),
+    ("speed_ground_x_self", 0x45, "f", 0),
+    ("ecb_top_x", 0x49, "f", 0),
+    ("ecb_top_y", 0x4D, "f", 0),
+    ("ecb_bottom_x", 0x51, "f", 0),
+    ("ecb_bottom_y", 0x55, "f", 0),
+    ("ecb_left_x", 0x59, "f", 0),
+    ("ecb_left_y", 0x5D, "f", 0),
+    ("ecb_right_x", 0x61, "f", 0),
+    ("ecb_right_y", 0x65, "f", 0),
+)
+
+ITEM_UPDATE_FIELDS = (
+    ("frame", 0x1, "i", 0),
+    ("type", 0x5, "H", 0),
+    ("x_speed", 0xC, "f", 0),
+    ("y_speed", 0x10, "f", 0),
+    ("x", 0x14, "f", 0),
+    ("y", 0x18, "f", 0),
+    ("owner", 0x2A, "B", 0xFF),
+)
+
+EVENT_FIELDS = {
+    EventType.PRE_FRAME: PRE_FRAME_FIELDS,
+    EventType.POST_FRAME: POST_FRAME_FIELDS,
+    EventType.ITEM_UPDATE: ITEM_UPDATE_FIELDS,
+}
+
+DECODER_REVISION = 1
+"""(int): Bump this whenever the decoders change what they return, beyond what the field
+    tables show. (IE: which rolled back frames or followers load_columns() keeps)"""
+
+DECODER_VERSION = hashlib.sha1(repr((__version__, DECODER_REVISION, EVENT_FIELDS)).encode()).hexdigest()[:12]
+"""(str): Fingerprint of the decoders. Changes whenever DECODER_REVISION, the field tables or
+    libmelee version do"""
+
+# NumPy equivalents of the struct formats used above
+_NUMPY_FORMATS = {
+    "B": "u1",
+    "H": ">u2",
+    "i": ">i4",
+    "f": ">f4",
+}
+
+class EventLayout:
+    """A decoder for one event type, specialised to the size of that event
+
+    Older SLP versions have shorter events, with newer fields simply cut off the end.
+    Since the fields are sorted by offset, whatever is missing is always a suffix of
+    the field list. So we decide once which fields fit, and pad the rest with defaults.
+    """
+    __slots__ = ('names', 'size', 'unpack')
+
+    def __init__(self, fields, event_size):
+        """Compile a layout
+
+        Args:
+            fields (tuple): One of the *_FIELDS tables
+            event_size (int): Size of the event in bytes, including the command byte
+        """
+        self.names = tuple(field[0] for field in fields)
+        self.size = event_size
+        fmt = ">"
+        position = 0
+        missing = []
+        for _, offset, code, default in fields:
+            end = offset + struct.calcsize(code)
+            if missing or end > event_size:
+                missing.append(default)
+                continue
+            if offset > position:
+                fmt += str(offset - position) + "x"
+            fmt += code
+            position = end
+        decoder = struct.Struct(fmt)
+        if missing:
+            padding = tuple(missing)
+            self.unpack = lambda buf, offset=0: decoder.unpack_from(buf, offset) + padding
+        else:
+            self.unpack = decoder.unpack_from
+
+def compile_layouts(eventsize):
+    """Build decoders for every event type we read, given the sizes from a PAYLOADS event
+
+    Args:
+        eventsize (list of int): Size of each event, indexed by command byte. Includes the command byte.
+
+    Returns:
+        dict of EventType to EventLayout
+    """
+    return {event_type: EventLayout(fields, eventsize[event_type.value]) for event_type, fields in EVENT_FIELDS.items()}
+
+def read_payload_sizes(buf, offset, eventsize):
+    """Read an Event Payloads event into the given event size table
+
+    Args:
+        buf (bytes-like): Buffer holding the event
+        offset (int): Where the PAYLOADS command byte is
+        eventsize (list of int): Table to fill in, indexed by command byte
+
+    Returns:
+        int: Total size of the PAYLOADS event, including its command byte
+    """
+    payload_size = buf[offset + 1]
+    cursor = offset + 0x2
+    for _ in range((payload_size - 1) // 3):
+        command, command_len = struct.unpack_from(">BH", buf, cursor)
+        eventsize[command] = command_len + 1
+        cursor += 3
+    return payload_size + 1
+
+def parse_game_start(buf, offset=0):
+    """Decode a Game Start event
+
+    Args:
+        buf (bytes-like): Buffer holding the event
+        offset (int): Where the GAME_START command byte is
+
+    Returns:
+        dict: With keys:
+            "version": (major, minor, build) SLP version tuple
+            "slp_version": The same version as a string. IE: "3.7.0"
+            "stage": enums.Stage being played on
+            "players": dict of port (1-4) to a dict with keys "character" (enums.Character),
+                "player_type" (0 human, 1 CPU, 2 demo, 3 empty), "costume", and "cpu_level".
+                cpu_level is 0 for anyone who isn't a CPU. character is None for empty slots.
+    """
+    major, minor, build = struct.unpack_from(">BBB", buf, offset + 0x1)
+    try:
+        stage = enums.to_internal_stage(struct.unpack_from(">H", buf, offset + 0x13)[0])
+    except ValueError:
+        stage = enums.Stage.NO_STAGE
+    players = {}
+    for i in range(4):
+        base = offset + (0x24 * i)
+        character, player_type, _, costume = struct.unpack_from(">BBBB", buf, base + 0x65)
+        cpu_level = buf[base + 0x74] if player_type == 1 else 0
+        players[i + 1] = {
+            "character": enums.from_external_id(character) if player_type != 3 else None,
+            "player_type": player_type,
+            "costume": costume,
+            "cpu_level": cpu_level,
+        }
+    return {
+        "version": (major, minor, build),
+        "slp_version": str(major) + "." + str(minor) + "." + str(build),
+        "stage": stage,
+        "players": players,
+    }
+
+def event_dtype(fields, event_size):
+    """Build a big-endian structured dtype that overlays one whole event
+
+    Fields that don't fit in the event (because the SLP version is too old) are left out.
+
+    Args:
+        fields (tuple): One of the *_FIELDS tables
+        event_size (int): Size of the event in bytes, including the command byte
+
+    Returns:
+        numpy.dtype
+    """
+    names, formats, offsets = [], [], []
+    for name, offset, code, _ in fields:
+        if offset + struct.calcsize(code) > event_size:
+            break
+        names.append(name)
+        formats.append(_NUMPY_FORMATS[code])
+        offsets.append(offset)
+    return np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": event_size})
+
+# UBJSON integer types that can be used for the length of the 'raw' array
+_UBJSON_LENGTH_TYPES = {
+    ord("i"): ">b",
+    ord("U"): ">B",
+    ord("I"): ">h",
+    ord("l"): ">i",
+    ord("L"): ">q",
+}
+
+def find_raw_range(buf):
+    """Locate the byte range of the 'raw' event stream inside an SLP file
+
+    SLP files are a UBJSON object that always starts with the 'raw' element,
+    which is a strongly typed uint8 array. So rather than parse the whole file,
+    we can just read its header to find where the events are.
+
+    Args:
+        buf (bytes-like): The start of the SLP file. (Doesn't need to be the whole thing)
+
+    Returns:
+        (int, int): The offset and length of the event stream. A length of 0
+            means the file hasn't been finalized yet, so the events run until EOF.
+            None if the header isn't laid out the way we expect.
+    """
+    header = b"{U\x03raw[$U#"
+    if bytes(buf[:len(header)]) != header or len(buf) < len(header) + 1:
+        return None
+    length_type = _UBJSON_LENGTH_TYPES.get(buf[len(header)])
+    if length_type is None:
+        return None
+    start = len(header) + 1 + struct.calcsize(length_type)
+    if len(buf) < start:
+        return None
+    length = struct.unpack_from(length_type, buf, len(header) + 1)[0]
+    return start, max(length, 0)
+
+def map_raw(file):
+    """Memory map the event stream of an open SLP file
+
+    Args:
+        file: SLP file, opened in binary mode
+
+    Returns:
+        (mmap.mmap, memoryview): The map (None if the file couldn't be mapped) and the
+            'raw' event stream inside it. If the header isn't laid out the way we expect,
+            the whole file gets parsed as UBJSON instead and the stream is a bytes object.
+    """
+    try:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files can't be mapped
+        mapped = None
+    if mapped is not None:
+        raw_range = find_raw_range(mapped)
+        if raw_range is not None:
+            start, length = raw_range
+            if length == 0 or start + length > len(mapped):
+                length = len(mapped) - start
+            return mapped, memoryview(mapped)[start:start+length]
+        mapped.close()
+
+    # Not a layout we recognize, so let the UBJSON parser deal with it
+    file.seek(0)
+    return None, ubjson.loadb(file.read())["raw"]
+
+@contextlib.contextmanager
+def open_raw(path):
+    """Context manager that memory maps the event stream of an SLP file
+
+    Anything that wraps the stream (like a NumPy array) has to be let go of before exiting.
+
+    Args:
+        path (str): Path to the SLP file
+
+    Yields:
+        memoryview: The 'raw' event stream. (Or bytes, if the file had to be parsed as UBJSON)
+    """
+    with open(path, mode='rb') as file:
+        mapped, raw = map_raw(file)
+        failed = True
+        try:
+            yield raw
+            failed = False
+        finally:
+            try:
+                if isinstance(raw, memoryview):
+                    raw.release()
+                if mapped is not None:
+                    mapped.close()
+            except BufferError:
+                # Something still holds on to the stream. If we're here because of an error,
+                # that error is the one worth seeing. The map gets closed once it's let go of
+                if not failed:
+                    raise
+
+def iter_events(raw, eventsize):
+    """Walk an event stream, one event at a time
+
+    Event Payloads events are read into the event size table as they go by.
+    Stops early at the first event that's unknown or cut off.
+
+    Args:
+        raw (bytes-like): The event stream
+        eventsize (list of int): Event size table to use and fill in, indexed by command byte
+
+    Yields:
+        (int, int): The command byte and offset of each event
+    """
+    payloads = EventType.PAYLOADS.value
+    index = 0
+    end = len(raw)
+    while index < end:
+        command = raw[index]
+        if command == payloads:
+            event_size = read_payload_sizes(raw, index, eventsize)
+        else:
+            event_size = eventsize[command]
+            if event_size == 0 or index + event_size > end:
+                return
+        yield command, index
+        index += event_size
+
+def _last_occurrences(frames):
+    """Indices of the last occurrence of each frame number, sorted by frame
+
+    Rollback causes frames to show up more than once in a replay. The last copy is the real one.
+    """
+    _, reverse_index = np.unique(frames[::-1], return_index=True)
+    return len(frames) - 1 - reverse_index
+
+def _first_occurrences(frames):
+    """Indices of the first occurrence of each frame number, sorted by frame"""
+    _, index = np.unique(frames, return_index=True)
+    return index
+
+def _gather(data, offsets, dtype):
+    """Copy the events at the given offsets into a structured array"""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    rows = data[offsets[:, None] + np.arange(dtype.itemsize)]
+    return rows.view(dtype).reshape(-1)
+
+def _gather_events(data, offsets, fields, event_size):
+    """Decode every event of one type. If the stream doesn't have that event type, it comes back empty"""
+    if event_size == 0:
+        _, offset, code, _ = fields[-1]
+        return np.zeros(0, dtype=event_dtype(fields, offset + struct.calcsize(code)))
+    return _gather(data, offsets, event_dtype(fields, event_size))
+
+ROLLBACK_LAST = "last"
+"""Keep the final copy of each rolled back frame. (What actually happened)"""
+ROLLBACK_FIRST = "first"
+"""Keep the first copy of each rolled back frame. (What Console.step() returns)"""
+
+def load_columns(path, rollback=ROLLBACK_LAST):
+    """Decode a whole SLP file into NumPy structured arrays
+
+    This skips GameState entirely. The event stream is walked once to find where each
+    event is, and then every event of a type is decoded in one vectorised call.
+
+    Args:
+        path (str): Path to the SLP file
+        rollback (str): Which copy to keep of frames that show up more than once because of
+            rollback. ROLLBACK_LAST for the final copy, or ROLLBACK_FIRST for the first one,
+            to match what Console.step() returns
+
+    Returns:
+        dict: With keys:
+            "pre_frame": dict of port (1-4) to structured array of PRE_FRAME_FIELDS, one record per frame
+            "post_frame": dict of port (1-4) to structured array of POST_FRAME_FIELDS, one record per frame
+            "item_update": structured array of ITEM_UPDATE_FIELDS, one record per item per frame
+
+        Index an array by field name to get a single column: columns["post_frame"][1]["x"] is
+        port 1's x position on every frame. Use as_block() to get a plain (frames, fields) array.
+        Records are sorted by frame. Ice Climbers' Nana (the follower) is left out of the per-port arrays.
+    """
+    if rollback == ROLLBACK_LAST:
+        occurrences = _last_occurrences
+    elif rollback == ROLLBACK_FIRST:
+        occurrences = _first_occurrences
+    else:
+        raise ValueError("rollback must be ROLLBACK_LAST or ROLLBACK_FIRST, not " + repr(rollback))
+
+    eventsize = [0] * 0x100
+    offsets = {EventType.PRE_FRAME.value: [], EventType.POST_FRAME.value: [], EventType.ITEM_UPDATE.value: []}
+    item_occurrence = []
+    bookend_offsets = []
+    item_update = EventType.ITEM_UPDATE.value
+    frame_bookend = EventType.FRAME_BOOKEND.value
+
+    with open_raw(path) as raw:
+        for command, index in iter_events(raw, eventsize):
+            if command in offsets:
+                offsets[command].append(index)
+                if command == item_update:
+                    item_occurrence.append(len(bookend_offsets))
+            elif command == frame_bookend:
+                bookend_offsets.append(index)
+
+        data = np.frombuffer(raw, dtype=np.uint8)
+        try:
+            columns = {}
+            for event_type, fields in ((EventType.PRE_FRAME, PRE_FRAME_FIELDS),
+                                       (EventType.POST_FRAME, POST_FRAME_FIELDS)):
+                events = _gather_events(data, offsets[event_type.value], fields, eventsize[event_type.value])
+                events = events[events["is_follower"] == 0]
+                per_port = {}
+                for port in np.unique(events["port"]):
+                    port_events = events[events["port"] == port]
+                    per_port[int(port) + 1] = port_events[occurrences(port_events["frame"])]
+                columns[event_type.name.lower()] = per_port
+
+            items = _gather_events(data, offsets[item_update], ITEM_UPDATE_FIELDS, eventsize[item_update])
+            if bookend_offsets:
+                # Only keep items from the copy of each frame we're keeping
+                bookend_frames = _gather(data, bookend_offsets, np.dtype({"names": ["frame"], "formats": [">i4"],
+                                                                          "offsets": [1], "itemsize": 5}))["frame"]
+                kept = np.zeros(len(bookend_frames) + 1, dtype=bool)
+                kept[occurrences(bookend_frames)] = True
+                items = items[kept[np.asarray(item_occurrence, dtype=np.int64)]]
+            columns["item_update"] = items[np.argsort(items["frame"], kind="stable")]
+        finally:
+            # Let go of the stream, so that it can be unmapped
+            del data
+    return columns
+
+def as_block(records, names=None, dtype=np.float32):
+    """Turn one of the structured arrays from load_columns() into a plain 2-D array
+
+    Example:
+        columns = melee.slp.load_columns("game.slp")
+        block = melee.slp.as_block(columns["post_frame"][1], ("x", "y", "percent"))
+        # block.shape == (frames, 3)
+
+    Args:
+        records (numpy.ndarray): Structured array, like columns["post_frame"][1]
+        names (sequence of str): Fields to include, in order. None for all of them, in the
+            order of records.dtype.names
+        dtype (numpy.dtype): Type to convert every field to
+
+    Returns:
+        numpy.ndarray: Shaped (len(records), len(names))
+    """
+    if names is not None:
+        records = records[list(names)]
+    return recfunctions.structured_to_unstructured(records, dtype=dtype)
+
+class FrameIndex:
+    """Where each frame starts in the event stream of an SLP file
+
+    Built in one pass over the file. Lets you jump straight to any frame without
+    decoding the ones before it. (See Console.seek()) It can be saved to a cache
+    directory, so that it only needs to be built once.
+    """
+    def __init__(self, frames, offsets, header_end):
+        self.frames = frames
+        """(numpy.ndarray of int): Every frame number in the replay, sorted"""
+        self.offsets = offsets
+        """(numpy.ndarray of int): Offset in the event stream of the first event of each frame"""
+        self.header_end = header_end
+        """(int): Offset of the first frame event. Everything before it is game setup"""
+
+    def __len__(self):
+        return len(self.frames)
+
+    def locate(self, frame):
+        """Find where a frame starts
+
+        Args:
+            frame (int): Frame number to look for. If the replay doesn't have that exact
+                frame, the next one after it is used instead.
+
+        Returns:
+            (int, int): The frame number found, and the offset of its first event
+
+        Raises:
+            ValueError: If the frame is past the end of the replay
+        """
+        position = int(np.searchsorted(self.frames, frame))
+        if position >= len(self.frames):
+            raise ValueError("Frame " + str(frame) + " is past the end of the replay")
+        return int(self.frames[position]), int(self.offsets[position])
+
+    @classmethod
+    def build(cls, raw):
+        """Index an event stream
+
+        Frames are delimited by FRAME_BOOKEND events when the replay has them. Older
+        replays don't, so a frame starts whenever the frame number on a PRE_FRAME or
+        POST_FRAME event goes up. Rolled back frames point to their final copy.
+
+        Args:
+            raw (bytes-like): The event stream
+
+        Returns:
+            FrameIndex
+        """
+        eventsize = [0] * 0x100
+        frames, offsets = [], []
+        header_end = None
+        frame_start = None
+        last_frame = None
+        frame_events = (EventType.FRAME_START.value, EventType.PRE_FRAME.value, EventType.POST_FRAME.value)
+        player_events = (EventType.PRE_FRAME.value, EventType.POST_FRAME.value)
+        frame_bookend = EventType.FRAME_BOOKEND.value
+        for command, offset in iter_events(raw, eventsize):
+            if header_end is None and command in frame_events:
+                header_end = offset
+            if eventsize[frame_bookend] > 0:
+                if command == frame_bookend:
+                    frames.append(struct.unpack_from(">i", raw, offset + 0x1)[0])
+                    offsets.append(frame_start)
+                    frame_start = None
+                elif frame_start is None and header_end is not None:
+                    frame_start = offset
+            elif command in player_events:
+                frame = struct.unpack_from(">i", raw, offset + 0x1)[0]
+                if last_frame is None or frame > last_frame:
+                    frames.append(frame)
+                    offsets.append(offset)
+                last_frame = frame
+
+        frames = np.asarray(frames, dtype=np.int32)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        final = _last_occurrences(frames)
+        return cls(frames[final], offsets[final], header_end if header_end is not None else len(raw))
+
+    @classmethod
+    def for_file(cls, path, raw=None, cache=None):
+        """Get the index of an SLP file, using a saved copy if there's an up to date one
+
+        Args:
+            path (str): Path to the SLP file
+            raw (bytes-like): The file's event stream, if it's already open
+            cache (str or cache.ReplayCache): Directory to load and save the index in, or a
+                ReplayCache to keep it in. None to just build it in memory
+
+        Returns:
+            FrameIndex
+        """
+        index_path = None
+        if cache is not None:
+            directory = getattr(cache, "index_directory", cache)
+            name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+            index_path = os.path.join(directory, name + ".idx.npz")
+        stat = os.stat(path)
+        signature = np.asarray([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        if index_path is not None:
+            try:
+                with np.load(index_path) as saved:
+                    if np.array_equal(saved["signature"], signature):
+                        return cls(saved["frames"], saved["offsets"], int(saved["header_end"]))
+            except (OSError, KeyError, ValueError):
+                pass
+
+        if raw is None:
+            with open_raw(path) as file_raw:
+                index = cls.build(file_raw)
+        else:
+            index = cls.build(raw)
+        if index_path is not None:
+            try:
+                os.makedirs(os.path.dirname(index_path), exist_ok=True)
+                with open(index_path, mode='wb') as file:
+                    np.savez(file, frames=index.frames, offsets=index.offsets,
+                             header_end=index.header_end, signature=signature)
+            except OSError:
+                # Read only directory, probably. Just don't cache it
+                pass
+        return index
+
+def scan_header(path):
+    """Read just the game setup and metadata of an SLP file
+
+    Only the Game Start event at the front of the file and the UBJSON metadata at
+    the back get read. The frames in between are skipped over entirely, so this is
+    fast enough to filter large collections of replays.
+
+    Args:
+        path (str): Path to the SLP file
+
+    Returns:
+        dict: Everything parse_game_start() returns, plus:
+            "metadata": The file's metadata (start time, platform, last frame, etc...)
+                None if the file hasn't been finished yet
+            "last_frame": Number of the final frame of the game, if the metadata says
+
+    Raises:
+        ValueError: If the file doesn't look like a replay
+    """
+    with open(path, mode='rb') as file:
+        head = file.read(64)
+        raw_range = find_raw_range(head)
+        if raw_range is None:
+            raise ValueError(path + " is not an SLP file")
+        start, length = raw_range
+
+        # Walk the few events at the front of the stream until we find Game Start
+        eventsize = [0] * 0x100
+        position = start
+        header = None
+        while header is None:
+            file.seek(position)
+            command = file.read(1)
+            if not command:
+                raise ValueError(path + " has no Game Start event")
+            if command[0] == EventType.PAYLOADS.value:
+                payload_size = file.read(1)[0]
+                file.seek(position)
+                position += read_payload_sizes(file.read(payload_size + 1), 0, eventsize)
+            elif command[0] == EventType.GAME_START.value:
+                size = eventsize[command[0]]
+                if size == 0:
+                    raise ValueError(path + " doesn't give the size of its Game Start event")
+                file.seek(position)
+                event = file.read(size)
+                if len(event) < size:
+                    raise ValueError(path + " ends part way through its Game Start event")
+                header = parse_game_start(event)
+            elif eventsize[command[0]] > 0:
+                position += eventsize[command[0]]
+            else:
+                raise ValueError(path + " has no Game Start event")
+
+        header["metadata"] = None
+        if length > 0:
+            file.seek(start + length)
+            tail = file.read()
+            try:
+                header["metadata"] = ubjson.loadb(b"{" + tail).get("metadata")
+            except ubjson.DecoderException:
+                pass
+        header["last_frame"] = (header["metadata"] or {}).get("lastFrame")
+    return header
@@ -3,9 +3,11 @@
 Reads Slippi game events from SLP file rather than over network
 """
 
-import ubjson
+import struct
+import time
 from enum import Enum
-import numpy as np
+
+from melee.slp import FrameIndex, find_raw_range, map_raw, read_payload_sizes
 
 # pylint: disable=too-few-public-methods
 class EventType(Enum):
@@ -20,71 +22,262 @@ class EventType(Enum):
     ITEM_UPDATE = 0x3b
     FRAME_BOOKEND = 0x3c
 
+_PAYLOADS = EventType.PAYLOADS.value
+_PRE_FRAME = EventType.PRE_FRAME.value
+_POST_FRAME = EventType.POST_FRAME.value
+_GAME_END = EventType.GAME_END.value
+_FRAME_BOOKEND = EventType.FRAME_BOOKEND.value
+
 class SLPFileStreamer:
-    def __init__(self, path):
+    def __init__(self, path, index_cache=None):
         self._path = path
+        self._index_cache = index_cache
         self._contents = None
+        self._mmap = None
         self.eventsize = [0] * 0x100
         self._index = 0
+        # Events are only read up to here
+        self._end = 0
         self._frame = -9999
+        self._pending_frame_end = False
+        self._frame_index = None
 
-    def shutdown(self):
-        pass
-
-    def _is_new_frame(self, event_bytes):
-        """Introspect the bytes of the event to see if it represents a new frame
+    @property
+    def disconnected(self):
+        """(bool): Whether every event in the file has been read. (Named to match SlippstreamClient)"""
+        return self._contents is not None and self._index >= self._end and not self._pending_frame_end
 
-        This is for supporting older SLP files that don't have frame bookends
-        """
-        if EventType(event_bytes[0]) in [EventType.POST_FRAME, EventType.PRE_FRAME]:
-            frame = np.ndarray((1,), ">i", event_bytes, 0x1)[0]
-            if frame > self._frame:
-                self._frame = frame
-                return True
-            self._frame = frame
-        return False
+    def shutdown(self):
+        """Release the memory map of the file"""
+        if self._contents is not None and isinstance(self._contents, memoryview):
+            self._contents.release()
+        self._contents = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Someone still holds a slice of the file. It'll get closed when they let go
+                pass
+            self._mmap = None
 
     def dispatch(self, dummy):
-        """Read a single game event off the buffer
-        """
-        if self._index >= len(self._contents):
-            return None
+        """Read the next frame's worth of events off the buffer
 
-        if EventType(self._contents[self._index]) == EventType.PAYLOADS:
-            cursor = 0x2
-            payload_size = self._contents[self._index+1]
-            num_commands = (payload_size - 1) // 3
-            for i in range(0, num_commands):
-                command = np.ndarray((1,), ">B", self._contents, cursor)[0]
-                command_len = np.ndarray((1,), ">H", self._contents, cursor + 0x1)[0]
-                self.eventsize[command] = command_len+1
-                cursor += 3
+        Everything from the current position up through the next FRAME_BOOKEND (or GAME_END)
+        comes back as a single game_event message, so that a whole frame gets handled at once.
 
-            wrapper = dict()
-            wrapper["type"] = "game_event"
-            wrapper["payload"] = self._contents[self._index : self._index+payload_size+1]
-            self._index += payload_size + 1
-            return wrapper
-
-        event_size = self.eventsize[self._contents[self._index]]
-
-        # Check to see if a new frame has happened for an old file type
-        if self._is_new_frame(self._contents[self._index : self._index+event_size]):
+        Older SLP files don't have frame bookends. For those, a frame ends right before the
+        first event of the next one, and is followed by a separate frame_end message.
+        """
+        if self._pending_frame_end:
+            self._pending_frame_end = False
             wrapper = dict()
             wrapper["type"] = "frame_end"
             wrapper["payload"] = b""
             return wrapper
 
+        contents = self._contents
+        eventsize = self.eventsize
+        start = self._index
+        index = start
+        has_bookends = eventsize[_FRAME_BOOKEND] > 0
+        while index < self._end:
+            command = contents[index]
+            if command == _PAYLOADS:
+                index += read_payload_sizes(contents, index, eventsize)
+                has_bookends = eventsize[_FRAME_BOOKEND] > 0
+                continue
+            event_size = eventsize[command]
+            if event_size == 0 or index + event_size > self._end:
+                break
+            # Check to see if a new frame has happened for an old file type
+            if not has_bookends and command in (_PRE_FRAME, _POST_FRAME):
+                frame = struct.unpack_from(">i", contents, index + 0x1)[0]
+                new_frame = frame > self._frame
+                self._frame = frame
+                if new_frame:
+                    self._pending_frame_end = True
+                    break
+            index += event_size
+            if command in (_FRAME_BOOKEND, _GAME_END):
+                break
+        self._index = index
+
+        if index == start:
+            if self._pending_frame_end:
+                return self.dispatch(dummy)
+            return None
         wrapper = dict()
         wrapper["type"] = "game_event"
-        wrapper["payload"] = self._contents[self._index : self._index+event_size]
-        self._index += event_size
-
+        wrapper["payload"] = contents[start:index]
         return wrapper
 
+    def frame_index(self):
+        """Get the FrameIndex of the file, building it if we need to"""
+        if self._frame_index is None:
+            self._frame_index = FrameIndex.for_file(self._path, self._contents, self._index_cache)
+            # Seeking skips over the Event Payloads event, so make sure we know the event sizes
+            read_payload_sizes(self._contents, 0, self.eventsize)
+        return self._frame_index
+
+    def header(self):
+        """The events that set up the game, before the first frame"""
+        return self._contents[:self.frame_index().header_end]
+
+    def seek(self, offset, frame):
+        """Move the read position to the start of a frame
+
+        Args:
+            offset (int): Offset of the first event of the frame
+            frame (int): Its frame number
+        """
+        # Reads in the event sizes, the first time
+        self.frame_index()
+        self._index = offset
+        self._frame = frame
+        self._pending_frame_end = False
+
     def connect(self):
+        """Open the SLP file
+
+        The file is memory mapped, and the event stream is handed out as
+        memoryview slices of the map. So the file contents never get copied
+        into Python bytes, and only the pages we actually touch are read in.
+        """
         with open(self._path, mode='rb') as file:
-            full = ubjson.loadb(file.read())
-            raw = full["raw"]
-            self._contents = raw
+            self._mmap, self._contents = map_raw(file)
+            self._end = len(self._contents)
             return True
+
+class SLPFileFollower(SLPFileStreamer):
+    """Reads an SLP file while it's still being written
+
+    Dolphin writes replays to disk as the game goes. This follows along behind it,
+    like 'tail -f', handing out each frame once its FRAME_BOOKEND has been written.
+    (Or once the next frame starts, for old replays without bookends)
+
+    The file is polled for new data, starting at min_delay between polls and backing
+    off to max_delay while nothing is happening. So a new frame is picked up at most
+    max_delay seconds after it lands.
+    """
+    def __init__(self, path, min_delay=0.0005, max_delay=0.004, timeout=60):
+        """Create a follower
+
+        Args:
+            path (str): Path to the SLP file
+            min_delay (float): Shortest time in seconds to wait between polls of the file
+            max_delay (float): Longest time in seconds to wait between polls of the file
+            timeout (float): Give up if the file doesn't grow for this many seconds.
+                None to wait forever.
+        """
+        super().__init__(path)
+        self._file = None
+        self._raw_start = None
+        self._scan = 0
+        self._finished = False
+        self._last_growth = time.time()
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    @property
+    def disconnected(self):
+        """(bool): Whether the game is over (or the file stopped growing), and everything's been read"""
+        if self._index < self._end or self._pending_frame_end:
+            return False
+        return self._finished or (self.timeout is not None and time.time() - self._last_growth > self.timeout)
+
+    def shutdown(self):
+        """Close the file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def frame_index(self):
+        raise ValueError("Can't index an SLP file that is still being written")
+
+    def _refill(self):
+        """Read anything appended to the file since last time
+
+        Returns:
+            bool: True if new events are ready to be read
+        """
+        data = self._file.read()
+        if not data:
+            return False
+        self._last_growth = time.time()
+        if self._raw_start is None:
+            # Still waiting on the UBJSON header
+            self._contents += data
+            raw_range = find_raw_range(self._contents)
+            if raw_range is None:
+                return False
+            self._raw_start = raw_range[0]
+            del self._contents[:self._raw_start]
+        else:
+            self._contents += data
+
+        # Drop whatever's already been read, now and then, so memory doesn't keep growing
+        if self._index > (1 << 20):
+            del self._contents[:self._index]
+            self._scan -= self._index
+            self._end -= self._index
+            self._index = 0
+
+        # Find the last complete frame. Events after it stay hidden until the frame is done
+        contents = self._contents
+        has_bookends = self.eventsize[EventType.FRAME_BOOKEND.value] > 0
+        ready = self._end
+        while self._scan < len(contents):
+            command = contents[self._scan]
+            if command == EventType.PAYLOADS.value:
+                if self._scan + 2 > len(contents) or self._scan + contents[self._scan + 1] + 1 > len(contents):
+                    break
+                event_size = read_payload_sizes(contents, self._scan, self.eventsize)
+                has_bookends = self.eventsize[EventType.FRAME_BOOKEND.value] > 0
+            else:
+                event_size = self.eventsize[command]
+                if event_size == 0:
+                    # Not an event. We've run into the metadata after the event stream
+                    self._finished = True
+                    break
+                if self._scan + event_size > len(contents):
+                    break
+            self._scan += event_size
+            if not has_bookends or command in (EventType.FRAME_BOOKEND.value, EventType.PAYLOADS.value,
+                                               EventType.GAME_START.value, EventType.GAME_END.value):
+                ready = self._scan
+            if command == EventType.GAME_END.value:
+                self._finished = True
+                break
+        grew = ready > self._end
+        self._end = ready
+        return grew
+
+    def dispatch(self, polling_mode):
+        """Read the next frame's worth of events, waiting for them to be written if need be
+
+        In polling mode, returns None right away if there's nothing new yet.
+        Otherwise, only returns None once the game is over (or the file stops growing).
+        """
+        delay = self.min_delay
+        while self._index >= self._end and not self._pending_frame_end:
+            if self._finished:
+                return None
+            if self._refill():
+                break
+            if polling_mode:
+                return None
+            if self.timeout is not None and time.time() - self._last_growth > self.timeout:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+        return super().dispatch(polling_mode)
+
+    def connect(self):
+        """Open the SLP file. It doesn't need to have anything in it yet"""
+        self._file = open(self._path, mode='rb')
+        self._contents = bytearray()
+        self._end = 0
+        self._refill()
+        return True
@@ -0,0 +1,193 @@
+"""Tools for testing bots (and libmelee itself) without a real Dolphin
+
+SlippstreamServer replays an SLP file over enet, speaking the same protocol as
+Slippi. Point a Console at it like you would at Dolphin, to exercise the whole
+network path: for load tests, benchmarks, or CI.
+"""
+
+import base64
+import json
+import select
+import struct
+import threading
+import time
+
+import enet
+
+from melee.slpfilestreamer import SLPFileStreamer
+
+_FRAME_BOOKEND = 0x3c
+
+class SlippstreamServer:
+    """A local stand-in for Slippi's spectator server, that streams an SLP file
+
+    Every client that connects gets the whole game (or picks up from the cursor it asks
+    for), one game_event message per frame.
+
+    Example:
+        with melee.testing.SlippstreamServer("game.slp", port=0, speed=4) as server:
+            console = melee.Console(is_dolphin=True, slippi_port=server.port)
+            console.connect()
+            while True:
+                gamestate = console.step()
+                if gamestate is None:
+                    break
+                ...
+
+    Note:
+        The replay needs frame bookends (SLP 3.0.0 and up), since that's what the
+        Console uses to tell where frames end when reading from the network.
+    """
+    def __init__(self, path, port=51441, address="127.0.0.1", speed=1.0, nick="libmelee", version="2.2.0",
+                 disconnect_at_end=True):
+        """Create a server. It doesn't start listening until start() or serve_forever()
+
+        Args:
+            path (str): The SLP file to stream
+            port (int): UDP port to listen on. 0 picks any free port (see the port attribute)
+            address (str): IP address to listen on
+            speed (float): Playback speed. 1 is real time (60 frames per second), 2 is twice
+                that, and so on. None (or 0) sends frames as fast as possible
+            nick (str): The nickname reported in the handshake
+            version (str): The Slippi version reported in the handshake
+            disconnect_at_end (bool): Hang up on each client once its game is over. That makes
+                Console.step() return None, which ends the usual loop
+        """
+        self.speed = speed
+        self.nick = nick
+        self.version = version
+        self.disconnect_at_end = disconnect_at_end
+        self.sent_at = {}
+        """(dict): time.perf_counter() of when each frame number was first sent. For measuring latency"""
+        self.messages_sent = 0
+        """(int): Total game_event messages sent, over all clients"""
+        self._frames = []
+        self._packets = []
+        self._load(path)
+        self._host = enet.Host(enet.Address(bytes(address, 'utf-8'), int(port)), 32, 0, 0)
+        self.port = self._host.address.port
+        """(int): UDP port the server is listening on"""
+        # Playback state of each client, by its slot in the host: [peer, cursor, start time]
+        self._clients = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _load(self, path):
+        """Split the file into one message per frame"""
+        streamer = SLPFileStreamer(path)
+        streamer.connect()
+        try:
+            while True:
+                message = streamer.dispatch(False)
+                if message is None:
+                    break
+                if message["type"] != "game_event":
+                    continue
+                payload = bytes(message["payload"])
+                frame = None
+                # Bookends got bigger in SLP 3.7.0, so go by the size the file gives them
+                bookend_size = streamer.eventsize[_FRAME_BOOKEND]
+                if bookend_size and len(payload) >= bookend_size and payload[-bookend_size] == _FRAME_BOOKEND:
+                    frame = struct.unpack_from(">i", payload, len(payload) - bookend_size + 1)[0]
+                cursor = len(self._packets)
+                self._frames.append(frame)
+                self._packets.append(json.dumps({
+                    "type": "game_event",
+                    "cursor": cursor,
+                    "next_cursor": cursor + 1,
+                    "payload": base64.b64encode(payload).decode(),
+                }).encode())
+        finally:
+            streamer.shutdown()
+
+    def __len__(self):
+        return len(self._packets)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Serve on a background thread
+
+        Returns:
+            SlippstreamServer: self
+        """
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self.serve_forever, name="slippstream-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving, and hang up on every client"""
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _due(self, client):
+        """When the client's next message should go out"""
+        if not self.speed:
+            return client[2]
+        return client[2] + client[1] / (60 * self.speed)
+
+    def serve_forever(self):
+        """Serve until stop() is called (from another thread)"""
+        try:
+            while not self._stopping.is_set():
+                now = time.perf_counter()
+                wait = 0.01
+                for key, client in list(self._clients.items()):
+                    peer, cursor, _ = client
+                    while cursor < len(self._packets) and self._due(client) <= now:
+                        peer.send(0, enet.Packet(self._packets[cursor], enet.PACKET_FLAG_RELIABLE))
+                        if self._frames[cursor] is not None:
+                            self.sent_at.setdefault(self._frames[cursor], now)
+                        self.messages_sent += 1
+                        cursor += 1
+                        client[1] = cursor
+                    if cursor < len(self._packets):
+                        wait = min(wait, self._due(client) - now)
+                    elif self.disconnect_at_end:
+                        peer.disconnect_later()
+                        del self._clients[key]
+                self._host.flush()
+                # pyenet holds on to the GIL while it waits inside service(), so wait in select() instead
+                if wait > 0:
+                    select.select([self._host.socket.fileno()], [], [], wait)
+                self._service()
+        finally:
+            for client in self._clients.values():
+                client[0].disconnect_now()
+            self._clients = {}
+            self._host.flush()
+
+    def _service(self):
+        """Handle everything that's come in from clients"""
+        event = self._host.service(0)
+        while event.type != enet.EVENT_TYPE_NONE:
+            if event.type == enet.EVENT_TYPE_RECEIVE:
+                try:
+                    message = json.loads(event.packet.data)
+                except json.JSONDecodeError:
+                    message = {}
+                if message.get("type") == "connect_request":
+                    cursor = min(max(0, int(message.get("cursor", 0))), len(self._packets))
+                    reply = json.dumps({
+                        "type": "connect_reply",
+                        "nick": self.nick,
+                        "version": self.version,
+                        "cursor": cursor,
+                    })
+                    event.peer.send(0, enet.Packet(reply.encode(), enet.PACKET_FLAG_RELIABLE))
+                    # Pace playback as though the requested cursor was where the game started
+                    start = time.perf_counter()
+                    if self.speed:
+                        start -= cursor / (60 * self.speed)
+                    self._clients[event.peer.incomingPeerID] = [event.peer, cursor, start]
+            elif event.type == enet.EVENT_TYPE_DISCONNECT:
+                self._clients.pop(event.peer.incomingPeerID, None)
+            event = self._host.service(0)
@@ -0,0 +1,174 @@
+"""How to wait for the next frame in polling mode
+
+With polling_mode on, step() used to return None the instant nothing was ready. A
+bot loop that just calls step() again then spins a whole core per console. A wait
+strategy decides what step() does instead: keep polling, poll for a bit and then
+sleep, or sleep until the next frame is due. Each one keeps track of how much wall
+and CPU time it spent waiting, so you can see what it costs.
+
+Example:
+    console = melee.Console(path=dolphin, polling_mode=True, wait_strategy=melee.FrameDeadlineWait())
+    while True:
+        gamestate = console.step()
+        if gamestate is None:
+            continue
+        ...
+    print(console.wait_strategy)
+"""
+
+import time
+
+FRAME_TIME = 1 / 60
+"""(float): Seconds between frames"""
+
+class WaitStrategy:
+    """Base class of the wait strategies. On its own, it doesn't wait at all
+
+    Subclasses just decide how long to block for on each poll (see timeout()).
+    """
+    def __init__(self, max_wait=FRAME_TIME):
+        """
+        Args:
+            max_wait (float): Give up waiting (and let step() return None) after this many
+                seconds, so the bot still gets control back now and then
+        """
+        self.max_wait = max_wait
+        self.waits = 0
+        """(int): How many times step() had to wait"""
+        self.wait_time = 0
+        """(int): Total nanoseconds spent waiting"""
+        self.cpu_time = 0
+        """(int): Total nanoseconds of CPU time burned while waiting"""
+        self.timeouts = 0
+        """(int): How many waits ran out before anything came in"""
+        self._last_frame = None
+
+    def frame_arrived(self, now=None):
+        """Let the strategy know a frame just came in
+
+        Args:
+            now (float): time.perf_counter() of when it arrived. None for right now
+        """
+        self._last_frame = time.perf_counter() if now is None else now
+
+    def timeout(self, now, waited):
+        """How long the next poll should block for
+
+        Args:
+            now (float): time.perf_counter()
+            waited (float): Seconds spent waiting so far
+
+        Returns:
+            float: Seconds to block for. 0 to just check and come right back. None to give up
+        """
+        return None
+
+    def wait(self, poll):
+        """Wait for something to come in
+
+        Args:
+            poll (callable): poll(timeout) checks for something, blocking for up to timeout
+                seconds until it shows up. Returns it, or None if there's nothing yet
+
+        Returns:
+            Whatever poll() returned. None if the strategy gave up first
+        """
+        start = time.perf_counter()
+        cpu_start = time.thread_time_ns()
+        result = None
+        now = start
+        while not result:
+            waited = now - start
+            timeout = self.timeout(now, waited)
+            if timeout is None:
+                self.timeouts += 1
+                break
+            result = poll(max(0, min(timeout, self.max_wait - waited)))
+            now = time.perf_counter()
+        self.waits += 1
+        self.wait_time += int((now - start) * 1e9)
+        self.cpu_time += time.thread_time_ns() - cpu_start
+        return result
+
+    @property
+    def cpu_fraction(self):
+        """(float): Share of the time spent waiting that was burned on the CPU. 1 for a spin"""
+        if self.wait_time == 0:
+            return 0.
+        return self.cpu_time / self.wait_time
+
+    def reset(self):
+        """Zero out the counters, and forget when the last frame came in"""
+        self.waits = 0
+        self.wait_time = 0
+        self.cpu_time = 0
+        self.timeouts = 0
+        self._last_frame = None
+
+    def __str__(self):
+        return "%s: %d waits, %.3fs waiting, %.3fs CPU (%.0f%%), %d timed out" % \
+            (type(self).__name__, self.waits, self.wait_time / 1e9, self.cpu_time / 1e9,
+             self.cpu_fraction * 100, self.timeouts)
+
+class SpinWait(WaitStrategy):
+    """Poll over and over, without ever sleeping
+
+    The lowest latency there is, at the cost of a whole core.
+    """
+    def timeout(self, now, waited):
+        if waited >= self.max_wait:
+            return None
+        return 0
+
+class SpinThenSleepWait(WaitStrategy):
+    """Poll for a little while, then fall back to sleeping between polls
+
+    Frames that come in right away are picked up as quick as a spin would. Once it's
+    clear the next one is a while off, it stops burning CPU. Over the network, the
+    "sleep" waits on the socket, so a frame landing mid-sleep still wakes it right up.
+    """
+    def __init__(self, spin_time=0.0005, sleep_time=0.001, max_wait=FRAME_TIME):
+        """
+        Args:
+            spin_time (float): Seconds to keep polling before starting to sleep
+            sleep_time (float): Seconds to sleep for between polls, after that
+            max_wait (float): Give up after this many seconds
+        """
+        super().__init__(max_wait)
+        self.spin_time = spin_time
+        self.sleep_time = sleep_time
+
+    def timeout(self, now, waited):
+        if waited >= self.max_wait:
+            return None
+        if waited < self.spin_time:
+            return 0
+        return self.sleep_time
+
+class FrameDeadlineWait(WaitStrategy):
+    """Sleep until just before the next frame is due, then spin for it
+
+    Frames come in at a steady 60 per second, so once one arrives the next one isn't due
+    for another 16.6ms. This sleeps through most of that gap, and spins for the last little
+    bit (the margin), to catch the frame as soon as it lands. Until the first frame shows
+    up there's no telling when it's due, so it polls with a backoff instead.
+    """
+    def __init__(self, fps=60, margin=0.002, max_wait=2 * FRAME_TIME):
+        """
+        Args:
+            fps (float): Frames per second the console runs at
+            margin (float): How long before the frame is due to start spinning, in seconds
+            max_wait (float): Give up after this many seconds. This is a couple of frames, so
+                that a frame that's a little late doesn't end the wait just before it shows up
+        """
+        super().__init__(max_wait)
+        self.frame_time = 1 / fps
+        self.margin = margin
+
+    def timeout(self, now, waited):
+        if waited >= self.max_wait:
+            return None
+        if self._last_frame is None:
+            # Sleep as long as we've waited so far, so the sleeps double, up to a quarter frame
+            return min(max(waited, self.margin / 4), self.frame_time / 4)
+        return max(0, self._last_frame + self.frame_time - self.margin - now)